@@ -0,0 +1,399 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""End to end export benchmark on procedurally generated scenes.
+
+Builds a scene of the given size inside Blender, exports it with the full KN5
+pipeline and appends one JSON line with the throughput and peak memory to the
+results file:
+
+    blender -b --factory-startup --python benchmarks/export_benchmark.py -- --preset medium \\
+        --results benchmarks/results.jsonl --label "texture cache rework"
+
+Any scene size option overrides the preset, see --help after the "--". With any
+Python 3 interpreter, run presets in fresh Blender processes, or compare the
+latest result of every scene configuration with the one before it:
+
+    python benchmarks/export_benchmark.py run --blender /opt/blender/blender --preset small --preset large
+    python benchmarks/export_benchmark.py compare benchmarks/results.jsonl --threshold 0.1
+
+compare exits with 1 if throughput dropped or peak memory grew by more than the threshold.
+"""
+
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS_PATH = os.path.join(ROOT_DIR, "benchmarks", "results.jsonl")
+
+# Grid resolution of the high-poly objects, 401 * 401 vertices exceed the 65536 vertex limit of a KN5 mesh
+HIGH_POLY_RESOLUTION = 400
+
+# Spacing of the generated objects in meters
+OBJECT_SPACING = 10.0
+
+PRESETS = {
+    "small": {
+        "meshes": 100,
+        "mesh_resolution": 8,
+        "materials": 10,
+        "textures": 5,
+        "texture_size": 256,
+        "high_poly": 0,
+        "hierarchies": 2,
+        "hierarchy_depth": 10,
+    },
+    "medium": {
+        "meshes": 1000,
+        "mesh_resolution": 16,
+        "materials": 50,
+        "textures": 20,
+        "texture_size": 512,
+        "high_poly": 2,
+        "hierarchies": 10,
+        "hierarchy_depth": 50,
+    },
+    "large": {
+        "meshes": 5000,
+        "mesh_resolution": 24,
+        "materials": 200,
+        "textures": 50,
+        "texture_size": 1024,
+        "high_poly": 8,
+        "hierarchies": 20,
+        "hierarchy_depth": 200,
+    },
+}
+
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+
+
+def main(argv):
+    if "--" in argv:
+        return run_benchmark(argv[argv.index("--") + 1:])
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run presets in background Blender processes")
+    run_parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="Blender executable")
+    run_parser.add_argument(
+        "--preset", action="append", choices=sorted(PRESETS), help="Preset to run, can be repeated, all if not set")
+    run_parser.add_argument(
+        "--results", default=DEFAULT_RESULTS_PATH, help="JSON lines file the results are appended to")
+    run_parser.add_argument("--label", default="", help="Free text stored with the results")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Exports per preset, the fastest one is reported")
+    compare_parser = commands.add_parser("compare", help="Compare the two latest results of each scene configuration")
+    compare_parser.add_argument("results", nargs="?", default=DEFAULT_RESULTS_PATH, help="JSON lines results file")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    options = parser.parse_args(argv[1:])
+    if options.command == "run":
+        return run_presets(options)
+    return compare_results(options.results, options.threshold)
+
+
+def run_presets(options):
+    returncode = EXIT_SUCCESS
+    for preset in options.preset or sorted(PRESETS):
+        print(f"Running preset '{preset}'", flush=True)
+        command = [
+            options.blender, "-b", "--factory-startup",
+            "--python-exit-code", str(EXIT_FAILURE),
+            "--python", os.path.abspath(__file__), "--",
+            "--preset", preset,
+            "--results", options.results,
+            "--label", options.label,
+            "--repeat", str(options.repeat),
+        ]
+        if subprocess.run(command, check=False).returncode != EXIT_SUCCESS:
+            print(f"Preset '{preset}' failed", file=sys.stderr)
+            returncode = EXIT_FAILURE
+    return returncode
+
+
+def compare_results(results_path, threshold):
+    records_by_config = {}
+    with open(results_path, "r") as results_file:
+        for line in results_file:
+            if line.strip():
+                record = json.loads(line)
+                records_by_config.setdefault(get_config_key(record["config"]), []).append(record)
+
+    returncode = EXIT_SUCCESS
+    for records in records_by_config.values():
+        if len(records) < 2:
+            continue
+        previous, latest = records[-2:]
+        print(f"{describe_config(latest['config'])}: '{previous['label']}' -> '{latest['label']}'")
+        # Lower is better for memory, higher for throughput
+        for metric, higher_is_better in (
+                ("triangles_per_second", True),
+                ("megabytes_per_second", True),
+                ("peak_rss_megabytes", False),
+                ("python_peak_megabytes", False)):
+            if not previous.get(metric) or latest.get(metric) is None:
+                continue
+            change = latest[metric] / previous[metric] - 1.0
+            is_regression = (-change if higher_is_better else change) > threshold
+            if is_regression:
+                returncode = EXIT_FAILURE
+            marker = "  REGRESSION" if is_regression else ""
+            print(f"\t{metric}: {previous[metric]:.1f} -> {latest[metric]:.1f} ({change:+.1%}){marker}")
+    return returncode
+
+
+def get_config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def describe_config(config):
+    return ", ".join(f"{name}={value}" for name, value in sorted(config.items()))
+
+
+def run_benchmark(args):
+    parser = argparse.ArgumentParser(
+        prog="blender -b --python benchmarks/export_benchmark.py --",
+        description="Generate a scene and benchmark its KN5 export.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small", help="Scene size to start from")
+    for name, value in PRESETS["small"].items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), help=f"Overrides '{name}' of the preset")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated geometry and textures")
+    parser.add_argument("--settings", help="settings.json to export with, none if not set")
+    parser.add_argument("--results", default=DEFAULT_RESULTS_PATH, help="JSON lines file the result is appended to")
+    parser.add_argument("--label", default="", help="Free text stored with the result")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of exports, the fastest one is reported")
+    parser.add_argument("--use-cache", action="store_true", help="Export with warm mesh and texture caches")
+    options = parser.parse_args(args)
+
+    import bpy # pylint: disable=import-outside-toplevel
+
+    config = dict(PRESETS[options.preset])
+    for name in config:
+        if getattr(options, name) is not None:
+            config[name] = getattr(options, name)
+    config["seed"] = options.seed
+    config["use_cache"] = options.use_cache
+    config["settings"] = os.path.basename(options.settings) if options.settings else None
+
+    cli = load_cli_module()
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    addon = cli.import_addon()
+    addon.register()
+    generation_start = time.perf_counter()
+    generate_scene(bpy, config)
+    generation_time = time.perf_counter() - generation_start
+    print(f"Generated scene in {generation_time:.2f} s: {describe_config(config)}", flush=True)
+
+    with tempfile.TemporaryDirectory() as output_directory:
+        if options.settings:
+            with open(options.settings, "r") as source, \
+                    open(os.path.join(output_directory, "settings.json"), "w") as destination:
+                destination.write(source.read())
+        output_path = os.path.join(output_directory, "benchmark.kn5")
+        context = cli.ExportContext(bpy.data, bpy.context.scene)
+        export_options = {
+            "use_mesh_cache": options.use_cache,
+            "use_texture_cache": options.use_cache,
+            "cache_directory": os.path.join(output_directory, "cache"),
+        }
+        if options.use_cache:
+            # Fill the caches, the timed exports then measure the warm path
+            addon.exporter.export_kn5(context, output_path, [], write_statistics=False, **export_options)
+
+        runs = []
+        for _ in range(max(1, options.repeat)):
+            start_time = time.perf_counter()
+            addon.exporter.export_kn5(context, output_path, [], **export_options)
+            export_time = time.perf_counter() - start_time
+            with open(os.path.splitext(output_path)[0] + addon.exporter.export_statistics.STATISTICS_FILE_SUFFIX) \
+                    as statistics_file:
+                statistics = json.load(statistics_file)
+            runs.append((export_time, statistics))
+            print(f"Exported in {export_time:.2f} s", flush=True)
+
+        # Tracing slows down the export, so peak allocations are measured in a separate untimed run
+        tracemalloc.start()
+        addon.exporter.export_kn5(context, output_path, [], write_statistics=False, **export_options)
+        _current, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    export_time, statistics = min(runs, key=lambda k: k[0])
+    counters = statistics["counters"]
+    record = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "label": options.label,
+        "commit": get_git_commit(),
+        "blender_version": bpy.app.version_string,
+        "config": config,
+        "generation_time": generation_time,
+        "export_times": [run_time for run_time, _statistics in runs],
+        "export_time": export_time,
+        "phases": statistics["phases"],
+        "counters": counters,
+        "triangles_per_second": counters["triangles"] / export_time,
+        "megabytes_per_second": counters["bytes_written"] / 2**20 / export_time,
+        "peak_rss_megabytes": get_peak_rss_megabytes(),
+        "python_peak_megabytes": python_peak / 2**20,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(options.results)), exist_ok=True)
+    with open(options.results, "a") as results_file:
+        results_file.write(json.dumps(record, sort_keys=True) + "\n")
+    print(
+        f"{counters['triangles']} triangles, {counters['bytes_written'] / 2**20:.1f} MB in {export_time:.2f} s: "
+        f"{record['triangles_per_second']:.0f} triangles/s, {record['megabytes_per_second']:.1f} MB/s, "
+        f"peak {record['python_peak_megabytes']:.0f} MB allocated")
+    return EXIT_SUCCESS
+
+
+def generate_scene(bpy, config):
+    """Fills the empty blend data with textures, materials, meshes and empty hierarchies."""
+    import numpy as np # pylint: disable=import-outside-toplevel
+
+    random = np.random.RandomState(config["seed"])
+    scene = bpy.context.scene
+    images = [
+        generate_image(bpy, np, random, f"benchmark_texture_{index:04d}", config["texture_size"])
+        for index in range(config["textures"])
+    ]
+    materials = []
+    for index in range(config["materials"]):
+        material = bpy.data.materials.new(f"benchmark_material_{index:04d}")
+        material.use_nodes = True
+        if images:
+            texture_node = material.node_tree.nodes.new("ShaderNodeTexImage")
+            texture_node.image = images[index % len(images)]
+        materials.append(material)
+
+    columns = max(1, int(np.ceil(np.sqrt(config["meshes"] + config["high_poly"]))))
+    for index in range(config["meshes"]):
+        mesh = generate_grid_mesh(bpy, np, random, f"benchmark_mesh_{index:05d}", config["mesh_resolution"], materials)
+        obj = bpy.data.objects.new(mesh.name, mesh)
+        obj.location = (index % columns * OBJECT_SPACING, index // columns * OBJECT_SPACING, 0.0)
+        scene.collection.objects.link(obj)
+    for index in range(config["high_poly"]):
+        mesh = generate_grid_mesh(bpy, np, random, f"benchmark_high_poly_{index:03d}", HIGH_POLY_RESOLUTION, materials)
+        obj = bpy.data.objects.new(mesh.name, mesh)
+        obj.location = (-(index + 1) * OBJECT_SPACING, 0.0, 0.0)
+        obj.scale = (OBJECT_SPACING / 2, OBJECT_SPACING / 2, 1.0)
+        scene.collection.objects.link(obj)
+
+    for index in range(config["hierarchies"]):
+        parent = None
+        for depth in range(config["hierarchy_depth"]):
+            empty = bpy.data.objects.new(f"benchmark_empty_{index:03d}_{depth:04d}", None)
+            empty.parent = parent
+            empty.location = (0.0, 0.0, 1.0) if parent else (index * OBJECT_SPACING, -OBJECT_SPACING, 0.0)
+            scene.collection.objects.link(empty)
+            parent = empty
+        mesh = generate_grid_mesh(bpy, np, random, f"benchmark_leaf_{index:03d}", config["mesh_resolution"], materials)
+        leaf = bpy.data.objects.new(mesh.name, mesh)
+        leaf.parent = parent
+        scene.collection.objects.link(leaf)
+
+
+def generate_image(bpy, np, random, name, size):
+    """Creates an unsaved image of smooth gradients and noise, which the exporter converts to PNG.
+
+    New images default to the PNG format, which the exporter packs with Blender's own
+    encoder. A TARGA image is converted from its pixels, so the PNG encoder is timed.
+    """
+    image = bpy.data.images.new(name, size, size, alpha=True)
+    image.file_format = "TARGA"
+    coordinates = np.linspace(0.0, 1.0, size, dtype=np.float32)
+    pixels = np.empty((size, size, 4), dtype=np.float32)
+    pixels[:, :, 0] = coordinates[None, :]
+    pixels[:, :, 1] = coordinates[:, None]
+    pixels[:, :, 2] = random.random_sample((size, size)) * 0.25
+    pixels[:, :, 3] = 1.0
+    image.pixels.foreach_set(pixels.ravel())
+    return image
+
+
+def generate_grid_mesh(bpy, np, random, name, resolution, materials):
+    """Creates a noisy height field of resolution * resolution quads with UVs and up to four materials."""
+    vertex_count = (resolution + 1) ** 2
+    coordinates = np.linspace(-1.0, 1.0, resolution + 1)
+    grid_x, grid_y = np.meshgrid(coordinates, coordinates)
+    positions = np.empty((vertex_count, 3), dtype=np.float32)
+    positions[:, 0] = grid_x.ravel()
+    positions[:, 1] = grid_y.ravel()
+    positions[:, 2] = random.random_sample(vertex_count) * 0.1
+
+    rows, cols = np.meshgrid(np.arange(resolution), np.arange(resolution), indexing="ij")
+    corners = (rows * (resolution + 1) + cols).ravel()
+    loops = np.stack((corners, corners + 1, corners + resolution + 2, corners + resolution + 1), axis=1).ravel()
+    polygon_count = resolution * resolution
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(vertex_count)
+    mesh.vertices.foreach_set("co", positions.ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops.astype(np.int32))
+    mesh.polygons.add(polygon_count)
+    mesh.polygons.foreach_set("loop_start", np.arange(0, len(loops), 4, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_total", np.full(polygon_count, 4, dtype=np.int32))
+    uv_layer = mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", ((positions[loops, :2] + 1.0) / 2.0).ravel())
+    if materials:
+        material_count = min(len(materials), 1 + random.randint(4))
+        first_material = random.randint(len(materials))
+        for offset in range(material_count):
+            mesh.materials.append(materials[(first_material + offset) % len(materials)])
+        # Bands of polygons per material, like road surfaces or kerbs
+        material_indices = (rows.ravel() * material_count // resolution).astype(np.int32)
+        mesh.polygons.foreach_set("material_index", material_indices)
+    mesh.update(calc_edges=True)
+    mesh.validate()
+    return mesh
+
+
+def load_cli_module():
+    spec = importlib.util.spec_from_file_location("kn5_cli", os.path.join(ROOT_DIR, "cli.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_git_commit():
+    try:
+        process = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return process.stdout.decode("utf-8").strip()
+
+
+def get_peak_rss_megabytes():
+    """Peak resident memory of the Blender process, None where the resource module is missing."""
+    try:
+        import resource # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss / 2**20 if sys.platform == "darwin" else peak_rss / 2**10
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,144 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Microbenchmark comparing the buffered KN5Writer with the old per-call struct.pack path.
+
+Runs with a plain Python interpreter, Blender is not required:
+
+    python benchmarks/kn5_writer_benchmark.py --vertices 200000
+"""
+
+
+import argparse
+import importlib
+import os
+import struct
+import sys
+import tempfile
+import time
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_kn5_writer_module():
+    # The kn5 package does not import bpy, unlike the add-on it is part of
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    return importlib.import_module("kn5.writer")
+
+
+class LegacyKN5Writer():
+    """The unbuffered writer: one struct.pack and one file.write per primitive."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def flush(self):
+        pass
+
+    def write_string(self, string):
+        string_bytes = string.encode("utf-8")
+        self.write_uint(len(string_bytes))
+        self.file.write(string_bytes)
+
+    def write_uint(self, int_val):
+        self.file.write(struct.pack("I", int_val))
+
+    def write_ushort(self, short):
+        self.file.write(struct.pack("H", short))
+
+    def write_bool(self, bool_val):
+        self.file.write(struct.pack("?", bool_val))
+
+    def write_float(self, f):
+        self.file.write(struct.pack("f", f))
+
+    def write_vector2(self, vector2):
+        self.file.write(struct.pack("2f", *vector2))
+
+    def write_vector3(self, vector3):
+        self.file.write(struct.pack("3f", *vector3))
+
+    def write_matrix(self, matrix):
+        for row in range(4):
+            for col in range(4):
+                self.write_float(matrix[col][row])
+
+
+def make_mesh(vertex_count):
+    vertices = []
+    for i in range(vertex_count):
+        f = float(i)
+        vertices.append(((f, f * 0.5, -f), (0.0, 1.0, 0.0), (f * 0.01, -f * 0.01), (1.0, 0.0, 0.0)))
+    indices = [i % 2**16 for i in range(vertex_count * 3)]
+    return vertices, indices
+
+
+def write_mesh(writer, vertices, indices, matrix):
+    writer.write_string("benchmark_mesh")
+    writer.write_matrix(matrix)
+    writer.write_bool(True)
+    writer.write_uint(len(vertices))
+    for co, normal, uv, tangent in vertices:
+        writer.write_vector3(co)
+        writer.write_vector3(normal)
+        writer.write_vector2(uv)
+        writer.write_vector3(tangent)
+    writer.write_uint(len(indices))
+    for i in indices:
+        writer.write_ushort(i)
+    writer.flush()
+
+
+def run(writer_class, vertices, indices, matrix, repeat):
+    best = None
+    data = None
+    for _ in range(repeat):
+        with tempfile.TemporaryFile() as output_file:
+            writer = writer_class(output_file)
+            start = time.perf_counter()
+            write_mesh(writer, vertices, indices, matrix)
+            output_file.flush()
+            elapsed = time.perf_counter() - start
+            output_file.seek(0)
+            data = output_file.read()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vertices", type=int, default=100000, help="Number of vertices to write")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs, the fastest one is reported")
+    args = parser.parse_args()
+
+    kn5_writer = load_kn5_writer_module()
+    vertices, indices = make_mesh(args.vertices)
+    matrix = [[float(row * 4 + col) for col in range(4)] for row in range(4)]
+
+    legacy_time, legacy_data = run(LegacyKN5Writer, vertices, indices, matrix, args.repeat)
+    buffered_time, buffered_data = run(kn5_writer.KN5Writer, vertices, indices, matrix, args.repeat)
+    if legacy_data != buffered_data:
+        raise Exception("Buffered writer output differs from the per-call writer output")
+
+    megabytes = len(buffered_data) / 2**20
+    print(f"Wrote {args.vertices} vertices, {len(indices)} indices ({megabytes:.1f} MB)")
+    print(f"Per-call writer: {legacy_time:.3f}s ({megabytes / legacy_time:.1f} MB/s)")
+    print(f"Buffered writer: {buffered_time:.3f}s ({megabytes / buffered_time:.1f} MB/s)")
+    print(f"Speedup: {legacy_time / buffered_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
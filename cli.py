@@ -0,0 +1,270 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Command line export of KN5 files.
+
+Export one blend file inside Blender:
+
+    blender -b track.blend --python cli.py -- --output track.kn5 --scene "Layout GP"
+
+Export only part of the file with --scope SCENE, VIEW_LAYER, SELECTION or
+COLLECTION together with --collection "Layout GP".
+
+Or run a manifest of jobs on a pool of background Blender processes, with any
+Python 3 interpreter:
+
+    python cli.py manifest.json --blender /opt/blender/blender --jobs 8 --results results.json
+
+A manifest lists the jobs, relative paths are resolved against its directory:
+
+    {
+        "jobs": [
+            {"blend_file": "monza.blend", "output": "build/monza.kn5", "scene": "GP"},
+            {"blend_file": "monza.blend", "output": "build/monza_junior.kn5", "scene": "Junior",
+             "options": {"png_compression": 9}}
+        ]
+    }
+
+Results are written as JSON, one entry per job. The exit code is 0 if all jobs
+succeeded, 1 if any failed and 2 for invalid arguments or manifests.
+"""
+
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+ADDON_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ADDON_MODULE_NAME = "io_export_kn5"
+
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+
+# Export options a job may set, with the type of their values
+EXPORT_OPTIONS = {
+    "use_mesh_cache": bool,
+    "mesh_cache_size": int,
+    "use_texture_cache": bool,
+    "texture_cache_size": int,
+    "png_compression": int,
+    "texture_threads": int,
+    "cache_directory": str,
+    "write_statistics": bool,
+    "scope": str,
+    "collection": str,
+    "measure_vertex_cache": bool,
+}
+
+# Lines of Blender output kept in the results of failed jobs
+OUTPUT_TAIL_LINES = 40
+
+
+def main(argv):
+    if "--" in argv:
+        return run_worker(argv[argv.index("--") + 1:])
+    return run_manifest(argv[1:])
+
+
+def run_manifest(args):
+    parser = argparse.ArgumentParser(description="Export the KN5 files of a manifest in parallel.")
+    parser.add_argument("manifest", help="JSON file listing the export jobs")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="Blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Blender processes run at a time")
+    parser.add_argument("--results", help="File for the JSON results, printed if not set")
+    parser.add_argument("--timeout", type=float, help="Seconds after which a job is stopped")
+    options = parser.parse_args(args)
+
+    try:
+        jobs = read_manifest(options.manifest)
+    except (OSError, ValueError) as error:
+        print(f"Invalid manifest '{options.manifest}': {error}", file=sys.stderr)
+        return EXIT_USAGE
+    process_count = max(1, min(options.jobs, len(jobs)))
+    # Texture encoding threads are shared out, so parallel jobs don't compete for the same cores
+    texture_threads = max(1, (os.cpu_count() or 1) // process_count)
+    with ThreadPoolExecutor(max_workers=process_count) as executor:
+        results = list(executor.map(
+            lambda job: run_job(job, options.blender, texture_threads, options.timeout), jobs))
+
+    output = json.dumps({"results": results}, indent=4)
+    if options.results:
+        with open(options.results, "w") as results_file:
+            results_file.write(output)
+    else:
+        print(output)
+    failed = [result for result in results if result["status"] != "success"]
+    for result in failed:
+        print(f"Failed to export '{result['output']}': {result['error']}", file=sys.stderr)
+    return EXIT_FAILURE if failed else EXIT_SUCCESS
+
+
+def read_manifest(path):
+    with open(path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    base_directory = os.path.dirname(os.path.abspath(path))
+    jobs = manifest.get("jobs") if isinstance(manifest, dict) else None
+    if not isinstance(jobs, list) or not jobs:
+        raise ValueError("expected a non-empty 'jobs' list")
+    for job in jobs:
+        if not isinstance(job, dict) or not job.get("blend_file") or not job.get("output"):
+            raise ValueError("every job needs a 'blend_file' and an 'output'")
+        options = job.get("options", {})
+        if not isinstance(options, dict):
+            raise ValueError("job 'options' must be an object")
+        for option, value in options.items():
+            if option not in EXPORT_OPTIONS or not isinstance(value, EXPORT_OPTIONS[option]):
+                raise ValueError(f"unknown or invalid option '{option}'")
+        job["blend_file"] = os.path.join(base_directory, job["blend_file"])
+        job["output"] = os.path.join(base_directory, job["output"])
+    return jobs
+
+
+def run_job(job, blender, texture_threads, timeout):
+    options = {"texture_threads": texture_threads}
+    options.update(job.get("options", {}))
+    result_file, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(result_file)
+    command = [
+        blender, "-b", "--factory-startup", job["blend_file"],
+        "--python-exit-code", str(EXIT_FAILURE),
+        "--python", os.path.abspath(__file__), "--",
+        "--output", job["output"],
+        "--result", result_path,
+        "--options", json.dumps(options),
+    ]
+    if job.get("scene"):
+        command.extend(("--scene", job["scene"]))
+    start_time = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+        process = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, check=False)
+        output = process.stdout.decode("utf-8", "replace")
+        returncode = process.returncode
+    except (OSError, subprocess.TimeoutExpired) as error:
+        output = str(error)
+        returncode = None
+    try:
+        with open(result_path, "r") as result_file:
+            result = json.load(result_file)
+    except (OSError, ValueError):
+        result = get_result(job["blend_file"], job.get("scene"), job["output"])
+        result["error"] = "Blender exited without a result"
+    finally:
+        os.remove(result_path)
+    result["returncode"] = returncode
+    result["duration"] = time.perf_counter() - start_time
+    if returncode != EXIT_SUCCESS and result["status"] == "success":
+        result["status"] = "failed"
+        result["error"] = f"Blender exited with code {returncode}"
+    if result["status"] != "success":
+        result["log"] = output.splitlines()[-OUTPUT_TAIL_LINES:]
+    return result
+
+
+def run_worker(args):
+    parser = argparse.ArgumentParser(
+        prog="blender -b <file.blend> --python cli.py --", description="Export the open blend file to KN5.")
+    parser.add_argument("--output", required=True, help="KN5 file to write")
+    parser.add_argument("--scene", help="Scene to export, the active scene if not set")
+    parser.add_argument("--result", help="File for the JSON result, printed if not set")
+    parser.add_argument(
+        "--scope", choices=("FILE", "SCENE", "COLLECTION", "VIEW_LAYER", "SELECTION"),
+        help="Objects to export, the whole file if not set")
+    parser.add_argument("--collection", help="Collection to export with the COLLECTION scope")
+    parser.add_argument("--options", default="{}", help="JSON object of export options")
+    options = parser.parse_args(args)
+
+    import bpy # pylint: disable=import-outside-toplevel
+
+    result = get_result(bpy.data.filepath, options.scene, options.output)
+    try:
+        scene = bpy.context.scene
+        if options.scene:
+            if options.scene not in bpy.data.scenes:
+                raise Exception(f"Scene '{options.scene}' not found in '{bpy.data.filepath}'")
+            scene = bpy.data.scenes[options.scene]
+        addon = import_addon()
+        addon.register()
+        export_options = json.loads(options.options)
+        if options.scope:
+            export_options["scope"] = options.scope
+        if options.collection:
+            export_options["collection"] = options.collection
+        view_layer = bpy.context.view_layer if scene == bpy.context.scene else None
+        warnings = []
+        start_time = time.perf_counter()
+        result["report"] = addon.exporter.export_kn5(
+            ExportContext(bpy.data, scene, view_layer), options.output, warnings, **export_options)
+        result["warnings"] = warnings
+        result["export_time"] = time.perf_counter() - start_time
+        result["status"] = "success"
+    except: # pylint: disable=bare-except
+        result["error"] = traceback.format_exc()
+
+    output = json.dumps(result, indent=4)
+    if options.result:
+        with open(options.result, "w") as result_file:
+            result_file.write(output)
+    else:
+        print(output)
+    return EXIT_SUCCESS if result["status"] == "success" else EXIT_FAILURE
+
+
+def get_result(blend_file, scene, output):
+    return {
+        "blend_file": blend_file,
+        "scene": scene,
+        "output": output,
+        "status": "failed",
+        "error": None,
+        "report": [],
+        "warnings": [],
+    }
+
+
+def import_addon():
+    """Imports this addon as a package, independent of the name of its directory."""
+    spec = importlib.util.spec_from_file_location(
+        ADDON_MODULE_NAME,
+        os.path.join(ADDON_DIRECTORY, "__init__.py"),
+        submodule_search_locations=[ADDON_DIRECTORY])
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[ADDON_MODULE_NAME] = addon
+    spec.loader.exec_module(addon)
+    return addon
+
+
+class ExportContext():
+    """Stands in for bpy.context, which can't switch scenes in background mode.
+
+    Uses the first view layer of the scene if no view layer is given.
+    """
+
+    def __init__(self, blend_data, scene, view_layer=None):
+        self.blend_data = blend_data
+        self.scene = scene
+        self.view_layer = view_layer or scene.view_layers[0]
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
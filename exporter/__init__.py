@@ -17,14 +17,21 @@
 import traceback
 import os
 import bpy
-from bpy.props import BoolProperty, StringProperty
+from bpy.props import BoolProperty, EnumProperty, IntProperty, StringProperty
 from bpy_extras.io_utils import ExportHelper
-from .exporter_utils import read_settings
-from .kn5_writer import KN5Writer
+from .export_cache import MeshCache, TextureCache
+from .export_scope import DEFAULT_EXPORT_SCOPE, EXPORT_SCOPES, ExportScope
+from .export_statistics import ExportStatistics
+from .exporter_utils import get_cache_directory, read_settings
 from .texture_writer import TextureWriter
 from .material_writer import MaterialWriter
 from .node_writer import NodeWriter
-from ..utils.constants import KN5_HEADER_BYTES
+from ..kn5.format import KN5_HEADER_BYTES
+from ..kn5.writer import KN5Writer
+
+
+# Nodes with the largest bounding sphere savings listed in the export report
+BOUNDING_SPHERE_REPORT_NODES = 10
 
 
 class ReportOperator(bpy.types.Operator):
@@ -76,30 +83,89 @@ class CopyClipboardButtonOperator(bpy.types.Operator):
 
 
 class KN5FileWriter(KN5Writer):
-    def __init__(self, file, context, settings, warnings):
+    def __init__(self, file, context, settings, warnings, mesh_cache=None, texture_cache=None,
+                 png_compression=6, texture_threads=0, scope=None, measure_vertex_cache=False):
         super().__init__(file)
 
         self.context = context
         self.settings = settings
         self.warnings = warnings
+        self.mesh_cache = mesh_cache
+        self.texture_cache = texture_cache
+        self.png_compression = png_compression
+        self.texture_threads = texture_threads
+        self.measure_vertex_cache = measure_vertex_cache
+        self.texture_writer = None
+        self.material_writer = None
+        self.node_writer = None
+        self.statistics = ExportStatistics()
+        self.scope = scope or ExportScope(context)
 
         self.file_version = 5
 
     def write(self):
         self._write_header()
         self._write_content()
+        self.flush()
 
     def _write_header(self):
         self.file.write(KN5_HEADER_BYTES)
         self.write_uint(self.file_version)
 
     def _write_content(self):
-        texture_writer = TextureWriter(self.file, self.context, self.warnings)
-        texture_writer.write()
-        material_writer = MaterialWriter(self.file, self.context, self.settings, self.warnings)
-        material_writer.write()
-        node_writer = NodeWriter(self.file, self.context, self.settings, self.warnings, material_writer)
-        node_writer.write()
+        with self.statistics.measure_phase("textures"):
+            self.texture_writer = TextureWriter(
+                self.file, self.context, self.warnings, self.texture_cache, self.png_compression,
+                self.texture_threads, self.statistics, self.scope)
+            self.texture_writer.write()
+        with self.statistics.measure_phase("materials"):
+            self.material_writer = MaterialWriter(
+                self.file, self.context, self.settings, self.warnings, self.texture_writer.texture_aliases,
+                self.scope)
+            self.material_writer.write()
+        with self.statistics.measure_phase("nodes"):
+            self.node_writer = NodeWriter(
+                self.file, self.context, self.settings, self.warnings, self.material_writer, self.mesh_cache,
+                self.statistics, self.scope, self.measure_vertex_cache)
+            self.node_writer.write()
+
+    def get_report(self):
+        report = self.statistics.get_summary()
+        if self.mesh_cache:
+            report.append(f"Mesh cache: {self.mesh_cache.hits} hits, {self.mesh_cache.misses} misses")
+        if self.texture_cache:
+            report.append(f"Texture cache: {self.texture_cache.hits} hits, {self.texture_cache.misses} misses")
+        vertex_cache_statistics = self.node_writer.vertex_cache_statistics
+        if vertex_cache_statistics.triangle_count:
+            acmr_before, acmr_after = vertex_cache_statistics.get_acmr()
+            atvr_before, atvr_after = vertex_cache_statistics.get_atvr()
+            report.append(
+                f"Vertex cache ({vertex_cache_statistics.mesh_count} meshes optimized): "
+                f"ACMR {acmr_before:.3f} -> {acmr_after:.3f}, ATVR {atvr_before:.3f} -> {atvr_after:.3f}")
+        report.extend(self._get_bounding_sphere_report())
+        if self.texture_writer.texture_aliases:
+            deduplicated_megabytes = self.texture_writer.deduplicated_bytes / 2**20
+            report.append(
+                f"Duplicate textures: {len(self.texture_writer.texture_aliases)} merged, "
+                f"{deduplicated_megabytes:.1f} MB saved")
+        return report
+
+    def _get_bounding_sphere_report(self):
+        volumes = self.node_writer.bounding_sphere_volumes
+        if not volumes:
+            return []
+        legacy_volume = sum(legacy for legacy, _tight in volumes.values())
+        tight_volume = sum(tight for _legacy, tight in volumes.values())
+        report = [
+            f"Bounding spheres: {legacy_volume - tight_volume:.0f} m³ culling volume saved "
+            f"({legacy_volume:.0f} -> {tight_volume:.0f} m³)"
+        ]
+        savings = sorted(volumes.items(), key=lambda k: k[1][1] - k[1][0])
+        for node_name, (legacy, tight) in savings[:BOUNDING_SPHERE_REPORT_NODES]:
+            report.append(f"\t{node_name}: {legacy - tight:.0f} m³ saved ({legacy:.0f} -> {tight:.0f} m³)")
+        if len(savings) > BOUNDING_SPHERE_REPORT_NODES:
+            report.append(f"\t... and {len(savings) - BOUNDING_SPHERE_REPORT_NODES} more nodes")
+        return report
 
 
 class ExportKN5(bpy.types.Operator, ExportHelper):
@@ -109,30 +175,81 @@ class ExportKN5(bpy.types.Operator, ExportHelper):
 
     filename_ext = ".kn5"
 
+    use_mesh_cache: BoolProperty(
+        name="Mesh Cache",
+        default=True,
+        description="Reuse the exported meshes of objects that did not change since the last export")
+    mesh_cache_size: IntProperty(
+        name="Mesh Cache Size (MB)",
+        default=1024,
+        min=0,
+        description="Least recently used meshes are removed when the cache grows beyond this size")
+    use_texture_cache: BoolProperty(
+        name="Texture Cache",
+        default=True,
+        description="Reuse textures converted by earlier exports")
+    texture_cache_size: IntProperty(
+        name="Texture Cache Size (MB)",
+        default=4096,
+        min=0,
+        description="Least recently used textures are removed when the cache grows beyond this size")
+    png_compression: IntProperty(
+        name="PNG Compression",
+        default=6,
+        min=0,
+        max=9,
+        description="Compression level for images that are converted to PNG")
+    texture_threads: IntProperty(
+        name="Texture Threads",
+        default=0,
+        min=0,
+        description="Number of threads encoding textures, 0 uses all processor cores")
+    scope: EnumProperty(
+        name="Scope",
+        items=EXPORT_SCOPES,
+        default=DEFAULT_EXPORT_SCOPE,
+        description="Objects to export, with their parents and the materials and textures they use")
+    collection: StringProperty(
+        name="Collection",
+        description="Collection to export with the Collection scope, including its child collections")
+    write_statistics: BoolProperty(
+        name="Write Statistics",
+        default=True,
+        description="Write times and counters of the export to a .stats.json file next to the KN5 file")
+    measure_vertex_cache: BoolProperty(
+        name="Measure Vertex Cache",
+        default=False,
+        description="Simulate the vertex cache before and after optimizing meshes and report the miss ratios")
+    cache_directory: StringProperty(
+        name="Cache Directory",
+        subtype="DIR_PATH",
+        description="Directory for export caches, uses the system temporary directory if empty")
+
     def execute(self, context):
         warnings = []
         try:
-            output_file = open(self.filepath, "wb")
-            try:
-                settings = read_settings(self.filepath)
-                kn5_writer = KN5FileWriter(output_file, context, settings, warnings)
-                kn5_writer.write()
-                bpy.ops.kn5.report_message(
-                    'INVOKE_DEFAULT',
-                    is_error=False,
-                    title="Exported successfully",
-                    message=os.linesep.join(warnings)
-                )
-            finally:
-                if not output_file is None:
-                    output_file.close()
+            report = export_kn5(
+                context, self.filepath, warnings,
+                use_mesh_cache=self.use_mesh_cache,
+                mesh_cache_size=self.mesh_cache_size,
+                use_texture_cache=self.use_texture_cache,
+                texture_cache_size=self.texture_cache_size,
+                png_compression=self.png_compression,
+                texture_threads=self.texture_threads,
+                cache_directory=self.cache_directory,
+                write_statistics=self.write_statistics,
+                measure_vertex_cache=self.measure_vertex_cache,
+                scope=self.scope,
+                collection=self.collection,
+            )
+            bpy.ops.kn5.report_message(
+                'INVOKE_DEFAULT',
+                is_error=False,
+                title="Exported successfully",
+                message=os.linesep.join(report + warnings)
+            )
         except: # pylint: disable=bare-except
             error = traceback.format_exc()
-            try:
-                # Remove output file so we can't crash the engine with a broken file
-                os.remove(self.filepath)
-            except: # pylint: disable=bare-except
-                pass
             warnings.append(error)
             bpy.ops.kn5.report_message(
                 'INVOKE_DEFAULT',
@@ -143,6 +260,53 @@ class ExportKN5(bpy.types.Operator, ExportHelper):
         return {'FINISHED'}
 
 
+def export_kn5(context, filepath, warnings, use_mesh_cache=True, mesh_cache_size=1024, use_texture_cache=True,
+               texture_cache_size=4096, png_compression=6, texture_threads=0, cache_directory="", write_statistics=True,
+               scope=DEFAULT_EXPORT_SCOPE, collection="", measure_vertex_cache=False):
+    """Exports the blend data of the context to a KN5 file and returns the report lines.
+
+    Warnings are appended to `warnings`. Errors are raised after the output file was
+    removed, so a broken file can't crash the engine. With `write_statistics`, times and
+    counters of the export are written to a JSON file next to the output file. `scope` is
+    one of EXPORT_SCOPES, `collection` names the collection of the COLLECTION scope. With
+    `measure_vertex_cache`, the report shows the vertex cache miss ratios of the optimized meshes.
+    """
+    export_scope = ExportScope(context, scope, collection)
+    try:
+        with open(filepath, "wb") as output_file:
+            settings = read_settings(filepath)
+            mesh_cache = None
+            if use_mesh_cache:
+                mesh_cache = MeshCache(
+                    get_cache_directory(cache_directory, "meshes"),
+                    mesh_cache_size * 1024 * 1024)
+            texture_cache = None
+            if use_texture_cache:
+                texture_cache = TextureCache(
+                    get_cache_directory(cache_directory, "textures"),
+                    texture_cache_size * 1024 * 1024)
+            kn5_writer = KN5FileWriter(
+                output_file, context, settings, warnings, mesh_cache, texture_cache,
+                png_compression, texture_threads, export_scope, measure_vertex_cache)
+            kn5_writer.write()
+            if mesh_cache:
+                mesh_cache.close()
+            if texture_cache:
+                texture_cache.close()
+        kn5_writer.statistics.finish(filepath)
+        report = kn5_writer.get_report()
+        if write_statistics:
+            statistics_path = kn5_writer.statistics.write_sidecar(filepath)
+            report.append(f"Statistics written to '{statistics_path}'")
+        return report
+    except: # pylint: disable=bare-except
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+        raise
+
+
 def menu_func(self, context):
     self.layout.operator(ExportKN5.bl_idname, text="Assetto Corsa (.kn5)")
 
@@ -0,0 +1,191 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import json
+import os
+import struct
+
+
+MESH_CACHE_MAGIC = b"KN5MESH1"
+MESH_CACHE_HEADER = struct.Struct("8s32sI")
+
+TEXTURE_CACHE_INDEX = "index.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_PREFIX_SIZE = 64 * 1024
+
+
+def hash_key(*parts):
+    key = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        key.update(str(part).encode("utf-8"))
+        key.update(b"\0")
+    return key.hexdigest()
+
+
+def hash_file(path):
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def hash_file_prefix(path, size=HASH_PREFIX_SIZE):
+    """Hashes the first `size` bytes of a file, to rule out most differing files before hashing all of them."""
+    with open(path, "rb") as source:
+        return hashlib.blake2b(source.read(size), digest_size=16).hexdigest()
+
+
+def write_file_atomic(path, chunks):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as temp_file:
+            for chunk in chunks:
+                temp_file.write(chunk)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def evict_least_recently_used(directory, size_limit):
+    """Removes the least recently modified blobs of a cache directory until it fits in `size_limit` bytes."""
+    entries = []
+    total_size = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(".bin"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total_size += stat.st_size
+    for _mtime, size, path in sorted(entries):
+        if total_size <= size_limit:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+
+class MeshCache():
+    """On-disk cache of the serialized mesh records of each object.
+
+    There is one entry per object, which stores the fingerprint of everything that
+    went into its records. An entry is only used while the fingerprint matches, and
+    is overwritten as soon as the object changes. The least recently used entries are
+    evicted once the cache grows beyond `size_limit` bytes.
+    """
+
+    def __init__(self, directory, size_limit):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def load(self, key, fingerprint):
+        """Returns the mesh count and serialized records, or None if the entry is missing or stale."""
+        path = self._get_path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                header = cache_file.read(MESH_CACHE_HEADER.size)
+                if len(header) == MESH_CACHE_HEADER.size:
+                    magic, cached_fingerprint, mesh_count = MESH_CACHE_HEADER.unpack(header)
+                    if magic == MESH_CACHE_MAGIC and cached_fingerprint == fingerprint:
+                        records = cache_file.read()
+                        # The modification time is used as the last access time for eviction
+                        os.utime(path)
+                        self.hits += 1
+                        return mesh_count, records
+        except OSError:
+            pass
+        self.misses += 1
+        return None
+
+    def store(self, key, fingerprint, mesh_count, records):
+        header = MESH_CACHE_HEADER.pack(MESH_CACHE_MAGIC, fingerprint, mesh_count)
+        write_file_atomic(self._get_path(key), (header, records))
+
+    def close(self):
+        evict_least_recently_used(self.directory, self.size_limit)
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+
+class TextureCache():
+    """Content-addressed on-disk cache of converted texture blobs.
+
+    Blobs are stored under a key derived from the content hash of their source. The
+    content hash of a source file is remembered together with its size and mtime, so
+    unchanged files are not hashed again. The least recently used blobs are evicted
+    once the cache grows beyond `size_limit` bytes.
+    """
+
+    def __init__(self, directory, size_limit):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.hits = 0
+        self.misses = 0
+        self._index_path = os.path.join(self.directory, TEXTURE_CACHE_INDEX)
+        self._index = {}
+        self._index_changed = False
+        os.makedirs(self.directory, exist_ok=True)
+        self._read_index()
+
+    def get_file_content_hash(self, path):
+        stat = os.stat(path)
+        entry = self._index.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        content_hash = hash_file(path)
+        self._index[path] = [stat.st_size, stat.st_mtime_ns, content_hash]
+        self._index_changed = True
+        return content_hash
+
+    def load(self, key):
+        path = self._get_path(key)
+        try:
+            with open(path, "rb") as blob_file:
+                blob = blob_file.read()
+            # The modification time is used as the last access time for eviction
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return blob
+
+    def store(self, key, blob):
+        write_file_atomic(self._get_path(key), (blob,))
+
+    def close(self):
+        if self._index_changed:
+            write_file_atomic(self._index_path, (json.dumps(self._index).encode("utf-8"),))
+            self._index_changed = False
+        self.evict()
+
+    def evict(self):
+        evict_least_recently_used(self.directory, self.size_limit)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path, "r") as index_file:
+                self._index = json.load(index_file)
+        except (OSError, ValueError):
+            self._index = {}
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
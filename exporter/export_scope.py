@@ -0,0 +1,81 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from .material_index import MaterialIndex
+
+
+EXPORT_SCOPES = (
+    ("FILE", "Whole File", "Export all objects of the blend file, in every scene"),
+    ("SCENE", "Scene", "Export the objects of the scene"),
+    ("COLLECTION", "Collection", "Export the objects of a collection and its child collections"),
+    ("VIEW_LAYER", "Visible Objects", "Export the objects visible in the view layer"),
+    ("SELECTION", "Selection", "Export the selected objects"),
+)
+
+DEFAULT_EXPORT_SCOPE = "FILE"
+
+
+class ExportScope():
+    """Objects and materials an export visits, and the texture nodes of the materials.
+
+    Parents of the objects in the scope are included, so every object keeps its place in
+    the hierarchy and its transform. Objects are kept in the order of the blend data.
+    Materials are the ones used by the objects, only the whole file scope includes
+    unused materials, which are reported as warnings.
+    """
+
+    def __init__(self, context, scope=DEFAULT_EXPORT_SCOPE, collection=""):
+        self.scope = scope
+        blend_data = context.blend_data
+        if scope == "FILE":
+            self.objects = list(blend_data.objects)
+            self.materials = list(blend_data.materials)
+        else:
+            scope_objects = self._get_scope_objects(context, scope, collection)
+            self.objects = self._get_objects_with_parents(blend_data, scope_objects)
+            self.materials = self._get_used_materials(blend_data, self.objects)
+        self.material_index = MaterialIndex(self.materials)
+
+    @staticmethod
+    def _get_objects_with_parents(blend_data, scope_objects):
+        names = set()
+        for obj in scope_objects:
+            while obj and obj.name_full not in names:
+                names.add(obj.name_full)
+                obj = obj.parent
+        return [obj for obj in blend_data.objects if obj.name_full in names]
+
+    @staticmethod
+    def _get_used_materials(blend_data, objects):
+        material_names = {
+            slot.material.name_full
+            for obj in objects if obj.type == "MESH"
+            for slot in obj.material_slots if slot.material
+        }
+        return [material for material in blend_data.materials if material.name_full in material_names]
+
+    @staticmethod
+    def _get_scope_objects(context, scope, collection):
+        if scope == "SCENE":
+            return context.scene.objects
+        if scope == "COLLECTION":
+            if collection not in context.blend_data.collections:
+                raise Exception(f"Collection '{collection}' to export not found")
+            return context.blend_data.collections[collection].all_objects
+        view_layer = context.view_layer
+        if scope == "VIEW_LAYER":
+            return [obj for obj in view_layer.objects if obj.visible_get(view_layer=view_layer)]
+        if scope == "SELECTION":
+            return [obj for obj in view_layer.objects if obj.select_get(view_layer=view_layer)]
+        raise Exception(f"Unknown export scope '{scope}', use one of {', '.join(k[0] for k in EXPORT_SCOPES)}")
@@ -0,0 +1,124 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+STATISTICS_FILE_SUFFIX = ".stats.json"
+
+COUNTERS = (
+    "objects",
+    "meshes",
+    "triangles",
+    "vertices",
+    "textures",
+    "textures_copied",
+    "textures_cached",
+    "textures_packed",
+    "textures_converted",
+    "texture_bytes",
+    "bytes_written",
+)
+
+# Slowest objects listed in the summary
+SUMMARY_OBJECTS = 5
+
+
+class ExportStatistics():
+    """Wall times per phase and object, and counters of one export.
+
+    Times of nested phases are included in their parent phase, and times of an
+    object are summed over all the places it is worked on.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.total_time = 0.0
+        self.phases = {}
+        self.objects = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    @contextmanager
+    def measure_phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start_time
+
+    @contextmanager
+    def measure_object(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.get_object(name)["time"] += time.perf_counter() - start_time
+
+    def get_object(self, name):
+        if name not in self.objects:
+            self.objects[name] = {"time": 0.0, "meshes": 0, "triangles": 0, "vertices": 0, "cached": False}
+            self.counters["objects"] += 1
+        return self.objects[name]
+
+    def add(self, counter, value=1):
+        self.counters[counter] += value
+
+    def add_mesh(self, object_name, vertex_count, triangle_count):
+        object_statistics = self.get_object(object_name)
+        object_statistics["meshes"] += 1
+        object_statistics["vertices"] += vertex_count
+        object_statistics["triangles"] += triangle_count
+        self.counters["meshes"] += 1
+        self.counters["vertices"] += vertex_count
+        self.counters["triangles"] += triangle_count
+
+    def finish(self, kn5_path):
+        self.total_time = time.perf_counter() - self.start_time
+        self.counters["bytes_written"] = os.path.getsize(kn5_path)
+
+    def to_dict(self):
+        objects = sorted(self.objects.items(), key=lambda k: k[1]["time"], reverse=True)
+        return {
+            "total_time": self.total_time,
+            "phases": self.phases,
+            "counters": self.counters,
+            "objects": [dict(name=name, **object_statistics) for name, object_statistics in objects],
+        }
+
+    def write_sidecar(self, kn5_path):
+        """Writes the statistics as JSON next to the KN5 file and returns its path."""
+        statistics_path = os.path.splitext(kn5_path)[0] + STATISTICS_FILE_SUFFIX
+        with open(statistics_path, "w") as statistics_file:
+            json.dump(self.to_dict(), statistics_file, indent=4)
+        return statistics_path
+
+    def get_summary(self):
+        phases = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.phases.items())
+        summary = [
+            f"Export time: {self.total_time:.2f} s ({phases})",
+            f"Written {self.counters['bytes_written'] / 2**20:.1f} MB: "
+            f"{self.counters['objects']} objects, {self.counters['meshes']} meshes, "
+            f"{self.counters['triangles']} triangles, {self.counters['vertices']} vertices",
+            f"Textures: {self.counters['textures']} ({self.counters['texture_bytes'] / 2**20:.1f} MB), "
+            f"{self.counters['textures_converted']} converted, {self.counters['textures_cached']} from cache, "
+            f"{self.counters['textures_copied']} copied, {self.counters['textures_packed']} packed",
+        ]
+        slowest_objects = sorted(self.objects.items(), key=lambda k: k[1]["time"], reverse=True)[:SUMMARY_OBJECTS]
+        if slowest_objects:
+            summary.append("Slowest objects: " + ", ".join(
+                f"{name} {object_statistics['time']:.2f} s" for name, object_statistics in slowest_objects))
+        return summary
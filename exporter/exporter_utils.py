@@ -16,6 +16,7 @@
 
 import json
 import os
+import tempfile
 import bpy
 from mathutils import Matrix, Quaternion, Vector
 
@@ -52,25 +53,6 @@ def get_texture_nodes(material):
     return texture_nodes
 
 
-def get_all_texture_nodes(context):
-    scene_texture_nodes = []
-    for obj in context.blend_data.objects:
-        if obj.type != "MESH":
-            continue
-        for slot in obj.material_slots:
-            if slot.material:
-                scene_texture_nodes.extend(get_texture_nodes(slot.material))
-    return scene_texture_nodes
-
-
-def get_active_material_texture_slot(material):
-    texture_nodes = get_texture_nodes(material)
-    for texture_node in texture_nodes:
-        if texture_node.show_texture:
-            return texture_node
-    return None
-
-
 def read_settings(file):
     full_path = os.path.abspath(file)
     dir_name = os.path.dirname(full_path)
@@ -78,3 +60,9 @@ def read_settings(file):
     if not os.path.exists(settings_path):
         return {}
     return json.loads(open(settings_path, "r").read())
+
+
+def get_cache_directory(cache_directory, name):
+    if not cache_directory:
+        cache_directory = os.path.join(tempfile.gettempdir(), "assetto_corsa_tools")
+    return os.path.join(bpy.path.abspath(cache_directory), name)
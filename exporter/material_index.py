@@ -0,0 +1,66 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from .exporter_utils import get_texture_nodes
+
+
+class MaterialTextures():
+    """Texture nodes of a material, its active texture node and the mapping of the active one."""
+
+    def __init__(self, material):
+        self.texture_nodes = get_texture_nodes(material)
+        self.active_texture_node = None
+        self.mapping_scale = (1.0, 1.0)
+        self.mapping_translation = (0.0, 0.0)
+        for texture_node in self.texture_nodes:
+            if texture_node.show_texture:
+                self.active_texture_node = texture_node
+                self.mapping_scale = tuple(texture_node.texture_mapping.scale)[:2]
+                self.mapping_translation = tuple(texture_node.texture_mapping.translation)[:2]
+                break
+
+
+class MaterialIndex():
+    """Texture nodes of the materials of an export, read from their node trees once.
+
+    Materials missing from the index, like the ones of objects outside the export
+    scope, are read on first use.
+    """
+
+    def __init__(self, materials):
+        self._materials = {}
+        for material in materials:
+            self.get(material)
+
+    def get(self, material):
+        if material.name_full not in self._materials:
+            self._materials[material.name_full] = MaterialTextures(material)
+        return self._materials[material.name_full]
+
+    def get_texture_nodes(self, material):
+        return self.get(material).texture_nodes
+
+    def get_active_texture_node(self, material):
+        return self.get(material).active_texture_node
+
+    def get_all_texture_nodes(self, objects):
+        """Texture nodes of all material slots of the mesh objects, once per slot using them."""
+        texture_nodes = []
+        for obj in objects:
+            if obj.type != "MESH":
+                continue
+            for slot in obj.material_slots:
+                if slot.material:
+                    texture_nodes.extend(self.get_texture_nodes(slot.material))
+        return texture_nodes
@@ -16,12 +16,9 @@
 
 import numbers
 import os
-import re
-from .exporter_utils import (
-    get_active_material_texture_slot,
-    get_texture_nodes,
-)
-from .kn5_writer import KN5Writer
+from .export_scope import ExportScope
+from .settings_rules import NameRules
+from ..kn5.writer import KN5Writer
 
 
 MATERIAL_BLEND_MODE = {
@@ -42,15 +39,18 @@ TEXTURES = "textures"
 
 
 class MaterialWriter(KN5Writer):
-    def __init__(self, file, context, settings, warnings):
+    def __init__(self, file, context, settings, warnings, texture_aliases=None, scope=None):
         super().__init__(file)
 
         self.available_materials = {}
         self.material_positions = {}
-        self.material_settings = []
+        self.materials_by_position = {}
+        self.material_settings = NameRules()
         self.context = context
         self.settings = settings
         self.warnings = warnings
+        self.texture_aliases = texture_aliases or {}
+        self.scope = scope or ExportScope(context)
         self._fill_available_materials()
 
     def write(self):
@@ -86,24 +86,29 @@ class MaterialWriter(KN5Writer):
     def _fill_available_materials(self):
         self.available_materials = {}
         self.material_positions = {}
-        self.material_settings = []
+        self.materials_by_position = {}
+        self.material_settings = NameRules()
         if MATERIALS in self.settings:
             for material_key in self.settings[MATERIALS]:
-                self.material_settings.append(MaterialSettings(self.settings, self.warnings, material_key))
+                self.material_settings.add(material_key, MaterialSettings(self.settings, self.warnings, material_key))
         position = 0
-        for material in self.context.blend_data.materials:
+        for material in self.scope.materials:
             if material.users == 0:
                 self.warnings.append(f"Ignoring unused material '{material.name}'")
             elif not material.name.startswith("__"):
-                if not get_active_material_texture_slot(material):
+                material_textures = self.scope.material_index.get(material)
+                if not material_textures.active_texture_node:
                     warning_message = f"No active texture for material '{material.name}' found.{os.linesep}"
                     warning_message += "\tUsing default UV scaling for objects without UV maps."
                     self.warnings.append(warning_message)
-                material_properties = MaterialProperties(material)
-                for setting in self.material_settings:
+                material_properties = MaterialProperties(material, material_textures.texture_nodes)
+                for setting in self.material_settings.resolve(material.name):
                     setting.apply_settings_to_material(material_properties)
-                self.available_materials[material.name] = material_properties
-                self.material_positions[material.name] = position
+                material_properties.rename_textures(self.texture_aliases)
+                # Keyed by full name, so materials of the same name from different libraries stay apart
+                self.available_materials[material.name_full] = material_properties
+                self.material_positions[material.name_full] = position
+                self.materials_by_position[position] = material_properties
                 position += 1
 
 
@@ -123,7 +128,7 @@ class ShaderProperty:
 
 
 class MaterialProperties:
-    def __init__(self, material):
+    def __init__(self, material, texture_nodes):
         self.name = material.name
         ac_mat = material.assettoCorsa
         self.shaderName = ac_mat.shaderName
@@ -131,7 +136,7 @@ class MaterialProperties:
         self.alphaTested = ac_mat.alphaTested
         self.depthMode = int(ac_mat.depthMode)
         self.shaderProperties = self.copy_shader_properties(material)
-        self.texture_mapping = self._generate_texture_mapping(material)
+        self.texture_mapping = self._generate_texture_mapping(texture_nodes)
 
     def copy_shader_properties(self, material):
         ac_mat = material.assettoCorsa
@@ -150,9 +155,13 @@ class MaterialProperties:
             properties[new_property.name] = new_property
         return properties
 
-    def _generate_texture_mapping(self, material):
+    def rename_textures(self, texture_names):
+        for mapping_name, texture_name in self.texture_mapping.items():
+            self.texture_mapping[mapping_name] = texture_names.get(texture_name, texture_name)
+
+    @staticmethod
+    def _generate_texture_mapping(texture_nodes):
         mapping = {}
-        texture_nodes = get_texture_nodes(material)
         for texture_node in texture_nodes:
             if not texture_node.image.name.startswith("__"):
                 shader_input = texture_node.assettoCorsa.shaderInputName
@@ -161,96 +170,85 @@ class MaterialProperties:
 
 
 class MaterialSettings:
+    """Material settings of a key of the materials section, read and checked once.
+
+    Matching material names is left to the NameRules the settings are added to.
+    """
+
     def __init__(self, settings, warnings, material_settings_key):
         self.settings = settings
         self.warnings = warnings
         self.material_settings_key = material_settings_key
-        self.material_name_matches = self._convert_to_matches_list(material_settings_key)
+        self.shader_name = self._get_material_shader()
+        self.alpha_blend_mode = self._get_material_blend_mode()
+        self.alpha_tested = self._get_material_alpha_tested()
+        self.depth_mode = self._get_material_depth_mode()
+        self.shader_properties = {
+            property_name: (
+                self._get_material_property_value_a(property_name),
+                self._get_material_property_value_b(property_name),
+                self._get_material_property_value_c(property_name),
+                self._get_material_property_value_d(property_name),
+            )
+            for property_name in self._get_material_property_names()
+        }
+        self.texture_mapping = {
+            texture_mapping_name: self._get_material_texture_mapping_name(texture_mapping_name)
+            for texture_mapping_name in self._get_material_texture_mapping_names()
+        }
 
     def apply_settings_to_material(self, material):
-        if not self._does_material_name_match(material.name):
-            return
-        shader_name = self._get_material_shader()
-        if shader_name:
-            material.shaderName = shader_name
-
-        alpha_blend_mode = self._get_material_blend_mode()
-        if alpha_blend_mode:
-            material.alphaBlendMode = alpha_blend_mode
-        alpha_tested = self._get_material_alpha_tested()
-        if alpha_tested:
-            material.alphaTested = alpha_tested
-        depth_mode = self._get_material_depth_mode()
-        if depth_mode:
-            material.depthMode = depth_mode
-
-        property_names = self._get_material_property_names()
-        if property_names:
+        if self.shader_name:
+            material.shaderName = self.shader_name
+        if self.alpha_blend_mode:
+            material.alphaBlendMode = self.alpha_blend_mode
+        if self.alpha_tested:
+            material.alphaTested = self.alpha_tested
+        if self.depth_mode:
+            material.depthMode = self.depth_mode
+
+        if self.shader_properties:
             material.shaderProperties.clear()
-        for property_name in property_names:
-            shader_property = None
-            if property_name in material.shaderProperties:
-                shader_property = material.shaderProperties[property_name]
-            else:
-                shader_property = ShaderProperty(property_name)
-                material.shaderProperties[property_name] = shader_property
-            value_a = self._get_material_property_value_a(property_name)
+        for property_name, (value_a, value_b, value_c, value_d) in self.shader_properties.items():
+            shader_property = ShaderProperty(property_name)
+            material.shaderProperties[property_name] = shader_property
             if value_a:
                 shader_property.valueA = value_a
-            value_b = self._get_material_property_value_b(property_name)
             if value_b:
                 shader_property.valueB = value_b
-            value_c = self._get_material_property_value_c(property_name)
             if value_c:
                 shader_property.valueC = value_c
-            value_d = self._get_material_property_value_d(property_name)
             if value_d:
                 shader_property.valueD = value_d
 
-        texture_mapping_names = self._get_material_texture_mapping_names()
-        if texture_mapping_names:
+        if self.texture_mapping:
             material.texture_mapping.clear()
-        for texture_mapping_name in texture_mapping_names:
-            texture_name = self._get_material_texture_mapping_name(texture_mapping_name)
+        for texture_mapping_name, texture_name in self.texture_mapping.items():
             if not texture_name:
-                msg = f"Ignoring texture mapping '{texture_name}' for material '{material.name}' without texture name"
+                msg = f"Ignoring texture mapping '{texture_mapping_name}' for material '{material.name}' "
+                msg += "without texture name"
                 self.warnings.append(msg)
             else:
                 material.texture_mapping[texture_mapping_name] = texture_name
 
-    def _does_material_name_match(self, material_name):
-        for regex in self.material_name_matches:
-            if regex.match(material_name):
-                return True
-        return False
-
-    def _convert_to_matches_list(self, key):
-        matches = []
-        for subkey in key.split("|"):
-            matches.append(re.compile(f"^{self._escape_match_key(subkey)}$", re.IGNORECASE))
-        return matches
-
-    def _escape_match_key(self, key):
-        wildcard_replacement = "__WILDCARD__"
-        key = key.replace("*", wildcard_replacement)
-        key = re.escape(key)
-        key = key.replace(wildcard_replacement, ".*")
-        return key
-
     def _get_material_shader(self):
         if "shaderName" in self.settings[MATERIALS][self.material_settings_key]:
             return self.settings[MATERIALS][self.material_settings_key]["shaderName"]
         return None
 
     def _get_material_blend_mode(self):
-        if "alphaBlendMode" in self.settings[MATERIALS][self.material_settings_key]:
-            return MATERIAL_BLEND_MODE[self.settings[MATERIALS][self.material_settings_key]["alphaBlendMode"]]
-        return None
+        return self._get_material_mode("alphaBlendMode", MATERIAL_BLEND_MODE)
 
     def _get_material_depth_mode(self):
-        if "depthMode" in self.settings[MATERIALS][self.material_settings_key]:
-            return MATERIAL_DEPTH_MODE[self.settings[MATERIALS][self.material_settings_key]["depthMode"]]
-        return None
+        return self._get_material_mode("depthMode", MATERIAL_DEPTH_MODE)
+
+    def _get_material_mode(self, setting, modes):
+        if setting not in self.settings[MATERIALS][self.material_settings_key]:
+            return None
+        mode = self.settings[MATERIALS][self.material_settings_key][setting]
+        if mode not in modes:
+            raise Exception(f"{setting} of '{self.material_settings_key}' must be one of {', '.join(modes)}")
+        return modes[mode]
 
     def _get_material_alpha_tested(self):
         if "alphaTested" in self.settings[MATERIALS][self.material_settings_key]:
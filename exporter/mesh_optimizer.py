@@ -0,0 +1,153 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import deque
+import numpy as np
+
+
+VERTEX_CACHE_SIZE = 16
+
+# Consecutive triangles sorted as one unit by optimize_overdraw
+OVERDRAW_CLUSTER_SIZE = 64
+
+
+def optimize_vertex_cache(indices, vertex_count, cache_size=VERTEX_CACHE_SIZE):
+    """Reorders triangles for the post-transform vertex cache with the Tipsify algorithm.
+
+    See Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex Locality and
+    Reduced Overdraw", 2007. Runs in linear time in the number of triangles.
+    """
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    triangle_count = len(triangles)
+    if triangle_count == 0:
+        return np.asarray(indices, dtype=np.int64)
+
+    # Triangles using each vertex, as offsets into one flat list
+    corner_vertices = triangles.ravel()
+    corner_triangles = np.repeat(np.arange(triangle_count), 3)
+    order = np.argsort(corner_vertices, kind="stable")
+    adjacency = corner_triangles[order].tolist()
+    live_triangles = np.bincount(corner_vertices, minlength=vertex_count)
+    offsets = np.concatenate(([0], np.cumsum(live_triangles))).tolist()
+    live_triangles = live_triangles.tolist()
+    triangle_vertices = triangles.tolist()
+
+    cache_time = [0] * vertex_count
+    emitted = [False] * triangle_count
+    dead_end = []
+    output = []
+    timestamp = cache_size + 1
+    cursor = 0
+    fanning_vertex = int(corner_vertices[0])
+    while fanning_vertex >= 0:
+        candidates = []
+        for triangle in adjacency[offsets[fanning_vertex]:offsets[fanning_vertex + 1]]:
+            if emitted[triangle]:
+                continue
+            for vertex in triangle_vertices[triangle]:
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                live_triangles[vertex] -= 1
+                if timestamp - cache_time[vertex] > cache_size:
+                    cache_time[vertex] = timestamp
+                    timestamp += 1
+            emitted[triangle] = True
+            output.append(triangle)
+
+        # Prefer the candidate that stays in the cache and has the most triangles left
+        fanning_vertex = -1
+        best_priority = -1
+        for vertex in candidates:
+            if live_triangles[vertex] > 0:
+                priority = 0
+                if timestamp - cache_time[vertex] + 2 * live_triangles[vertex] <= cache_size:
+                    priority = timestamp - cache_time[vertex]
+                if priority > best_priority:
+                    best_priority = priority
+                    fanning_vertex = vertex
+
+        if fanning_vertex < 0:
+            while dead_end:
+                vertex = dead_end.pop()
+                if live_triangles[vertex] > 0:
+                    fanning_vertex = vertex
+                    break
+        if fanning_vertex < 0:
+            while cursor < vertex_count:
+                if live_triangles[cursor] > 0:
+                    fanning_vertex = cursor
+                    break
+                cursor += 1
+
+    return triangles[np.array(output, dtype=np.int64)].ravel()
+
+
+def optimize_overdraw(positions, indices, cluster_size=OVERDRAW_CLUSTER_SIZE):
+    """Sorts clusters of consecutive triangles so the outer, outward facing ones are drawn first.
+
+    Clusters are cut from the current triangle order, so the vertex locality gained by
+    optimize_vertex_cache is kept within each of them. They are ordered by the distance
+    of their centroid from the mesh centroid along their average normal, as proposed
+    for Tipsify, which draws potential occluders before the surfaces behind them.
+    """
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    triangle_count = len(triangles)
+    if triangle_count <= cluster_size:
+        return np.asarray(indices, dtype=np.int64)
+
+    corners = np.asarray(positions, dtype=np.float64)[triangles]
+    # Face normals scaled by twice the triangle area, so larger triangles weigh more
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    centroids = corners.mean(axis=1)
+    mesh_centroid = centroids.mean(axis=0)
+
+    cluster_starts = np.arange(0, triangle_count, cluster_size)
+    cluster_sizes = np.diff(np.append(cluster_starts, triangle_count))
+    cluster_centroids = np.add.reduceat(centroids, cluster_starts, axis=0) / cluster_sizes[:, None]
+    cluster_normals = np.add.reduceat(face_normals, cluster_starts, axis=0)
+    normal_lengths = np.linalg.norm(cluster_normals, axis=1)
+    normal_lengths[normal_lengths == 0.0] = 1.0
+    cluster_normals /= normal_lengths[:, None]
+
+    occlusion = np.einsum("ij,ij->i", cluster_centroids - mesh_centroid, cluster_normals)
+    cluster_order = np.argsort(-occlusion, kind="stable")
+    triangle_order = (cluster_starts[cluster_order, None] + np.arange(cluster_size)).ravel()
+    triangle_order = triangle_order[triangle_order < triangle_count]
+    return triangles[triangle_order].ravel()
+
+
+def optimize_vertex_fetch(vertices, indices):
+    """Renumbers vertices in the order the index buffer first uses them."""
+    indices = np.asarray(indices, dtype=np.int64)
+    used_vertices, first_uses = np.unique(indices, return_index=True)
+    fetch_order = used_vertices[np.argsort(first_uses)]
+    remap = np.empty(len(vertices), dtype=np.int64)
+    remap[fetch_order] = np.arange(len(fetch_order))
+    return vertices[fetch_order], remap[indices]
+
+
+def count_vertex_cache_misses(indices, cache_size=VERTEX_CACHE_SIZE):
+    """Simulates a FIFO post-transform cache and returns the number of vertices transformed."""
+    cache = deque()
+    cached = set()
+    misses = 0
+    for vertex in np.asarray(indices).tolist():
+        if vertex in cached:
+            continue
+        misses += 1
+        cache.append(vertex)
+        cached.add(vertex)
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+    return misses
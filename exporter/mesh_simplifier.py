@@ -0,0 +1,180 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+from ..kn5.format import VERTEX_DTYPE
+
+
+MAX_GRID_RESOLUTION = 4096
+
+# Pulls the quadric minimum towards the cell average where the quadric is flat
+QUADRIC_REGULARIZATION = 1e-3
+
+
+def simplify_mesh(vertices, indices, ratio):
+    """Reduces a mesh to at most `ratio` of its triangles with quadric error clustering.
+
+    Vertices are merged per cell of a uniform grid and placed where the summed plane
+    quadrics of their triangles are smallest, following Lindstrom, "Out-of-Core
+    Simplification of Large Polygonal Models", 2000. The grid resolution is searched
+    for the largest triangle count within the target. Vertices of a cell that belong to
+    different connected parts of the mesh, which are split along UV seams and hard
+    edges, share the position of the cell but keep their own normals and UVs. Returns
+    None if nothing would be left.
+    """
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    target_count = int(len(triangles) * ratio)
+    positions = vertices["position"].astype(np.float64)
+    if target_count < 1 or len(positions) == 0:
+        return None
+    grid_origin = positions.min(axis=0)
+    grid_extent = (positions.max(axis=0) - grid_origin).max()
+    if grid_extent <= 0.0:
+        return None
+
+    best = None
+    low, high = 1, MAX_GRID_RESOLUTION
+    while low <= high:
+        resolution = (low + high) // 2
+        cell_coordinates = _get_cell_coordinates(positions, grid_origin, grid_extent, resolution)
+        cells, kept_triangles = _cluster_triangles(cell_coordinates, triangles)
+        if len(kept_triangles) <= target_count:
+            best = (resolution, cell_coordinates, cells, kept_triangles)
+            low = resolution + 1
+        else:
+            high = resolution - 1
+    if best is None or len(best[3]) == 0:
+        return None
+
+    resolution, cell_coordinates, cells, kept_triangles = best
+    cell_positions = _get_cell_positions(positions, triangles, cells)
+    # Keep every vertex within its cell, the quadric minimum can lie far outside for flat areas
+    cell_size = grid_extent / resolution
+    cell_minimum = np.empty_like(cell_positions)
+    cell_minimum[cells] = grid_origin + cell_coordinates * cell_size
+    cell_positions = np.clip(cell_positions, cell_minimum, cell_minimum + cell_size)
+
+    components = _get_connected_components(len(positions), triangles)
+    cluster_keys, clusters = np.unique(cells * np.int64(len(positions)) + components, return_inverse=True)
+    clusters = clusters.ravel()
+    cluster_positions = cell_positions[cluster_keys // len(positions)]
+    used_clusters, new_indices = np.unique(clusters[triangles[kept_triangles]], return_inverse=True)
+    new_vertices = _get_cluster_vertices(vertices, positions, clusters, cluster_positions)[used_clusters]
+    return new_vertices, new_indices.ravel()
+
+
+def _get_cell_coordinates(positions, grid_origin, grid_extent, resolution):
+    coordinates = np.floor((positions - grid_origin) * (resolution / grid_extent)).astype(np.int64)
+    return np.clip(coordinates, 0, resolution - 1)
+
+
+def _cluster_triangles(cell_coordinates, triangles):
+    """Returns the occupied cell of each vertex, and the triangles that remain after clustering in their order."""
+    cell_keys = cell_coordinates @ np.array([MAX_GRID_RESOLUTION ** 2, MAX_GRID_RESOLUTION, 1], dtype=np.int64)
+    _cell_keys, cells = np.unique(cell_keys, return_inverse=True)
+    cells = cells.ravel()
+    corner_cells = cells[triangles]
+    kept = np.flatnonzero(
+        (corner_cells[:, 0] != corner_cells[:, 1])
+        & (corner_cells[:, 1] != corner_cells[:, 2])
+        & (corner_cells[:, 2] != corner_cells[:, 0]))
+    # Triangles connecting the same cells collapse into one, also across seams, so no faces overlap
+    cell_count = np.int64(cells.max() + 1)
+    sorted_corners = np.sort(corner_cells[kept], axis=1)
+    triangle_keys = (sorted_corners[:, 0] * cell_count + sorted_corners[:, 1]) * cell_count + sorted_corners[:, 2]
+    _keys, first_triangles = np.unique(triangle_keys, return_index=True)
+    return cells, kept[np.sort(first_triangles)]
+
+
+def _get_connected_components(vertex_count, triangles):
+    """Labels each vertex with the smallest vertex index of the triangle-connected part it belongs to.
+
+    Exported meshes have separate vertices on both sides of UV seams and hard edges,
+    so the parts end there. Roots of connected labels are hooked onto the smaller one,
+    then all labels jump to their root, until no triangle edge connects two labels.
+    """
+    labels = np.arange(vertex_count, dtype=np.int64)
+    edge_starts = triangles.ravel()
+    edge_ends = triangles[:, [1, 2, 0]].ravel()
+    while True:
+        start_labels = labels[edge_starts]
+        end_labels = labels[edge_ends]
+        connecting = start_labels != end_labels
+        if not connecting.any():
+            return labels
+        start_labels = start_labels[connecting]
+        end_labels = end_labels[connecting]
+        np.minimum.at(labels, np.maximum(start_labels, end_labels), np.minimum(start_labels, end_labels))
+        while True:
+            root_labels = labels[labels]
+            if np.array_equal(root_labels, labels):
+                break
+            labels = root_labels
+
+
+def _get_cell_positions(positions, triangles, cells):
+    cell_count = cells.max() + 1
+    corners = positions[triangles]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(face_normals, axis=1)
+    areas = lengths / 2
+    lengths[lengths == 0.0] = 1.0
+    face_normals /= lengths[:, None]
+    plane_offsets = -np.einsum("ij,ij->i", face_normals, corners[:, 0])
+
+    # Area weighted plane quadrics, summed into the cells of all three corners
+    corner_cells = cells[triangles].ravel()
+    quadrics = np.empty((cell_count, 3, 3))
+    linear_terms = np.empty((cell_count, 3))
+    for row in range(3):
+        for col in range(3):
+            weights = np.repeat(areas * face_normals[:, row] * face_normals[:, col], 3)
+            quadrics[:, row, col] = np.bincount(corner_cells, weights, minlength=cell_count)
+        weights = np.repeat(areas * face_normals[:, row] * plane_offsets, 3)
+        linear_terms[:, row] = np.bincount(corner_cells, weights, minlength=cell_count)
+
+    vertex_counts = np.bincount(cells, minlength=cell_count)
+    averages = np.empty((cell_count, 3))
+    for axis in range(3):
+        averages[:, axis] = np.bincount(cells, positions[:, axis], minlength=cell_count)
+    averages /= np.maximum(vertex_counts, 1)[:, None]
+
+    regularization = QUADRIC_REGULARIZATION * np.trace(quadrics, axis1=1, axis2=2) + 1e-12
+    quadrics += regularization[:, None, None] * np.eye(3)
+    right_hand_sides = regularization[:, None] * averages - linear_terms
+    return np.linalg.solve(quadrics, right_hand_sides[:, :, None])[:, :, 0]
+
+
+def _get_cluster_vertices(vertices, positions, clusters, cluster_positions):
+    """Averages normals and tangents per cluster and takes the UV of the vertex closest to its new position."""
+    cluster_count = len(cluster_positions)
+    cluster_vertices = np.zeros(cluster_count, dtype=VERTEX_DTYPE)
+    cluster_vertices["position"] = cluster_positions
+    for field in ("normal", "tangent"):
+        values = vertices[field].astype(np.float64)
+        sums = np.empty((cluster_count, 3))
+        for axis in range(3):
+            sums[:, axis] = np.bincount(clusters, values[:, axis], minlength=cluster_count)
+        lengths = np.linalg.norm(sums, axis=1)
+        lengths[lengths == 0.0] = 1.0
+        cluster_vertices[field] = sums / lengths[:, None]
+
+    offsets = positions - cluster_positions[clusters]
+    distances = np.einsum("ij,ij->i", offsets, offsets)
+    order = np.lexsort((distances, clusters))
+    is_closest = np.ones(len(order), dtype=np.bool_)
+    is_closest[1:] = clusters[order][1:] != clusters[order][:-1]
+    closest = order[is_closest]
+    cluster_vertices["uv"][clusters[closest]] = vertices["uv"][closest]
+    return cluster_vertices
@@ -0,0 +1,195 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+from ..kn5.format import INDEX_DTYPE, VERTEX_DTYPE
+
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Relative margin added to bounding spheres, covers rounding when they are stored as float32
+BOUNDING_SPHERE_EPSILON = 1e-6
+BOUNDING_SPHERE_MAX_ITERATIONS = 64
+
+
+def encode_vertex_buffer(vertices):
+    """Packs a VERTEX_DTYPE array into one contiguous 44 bytes per vertex array."""
+    return np.ascontiguousarray(vertices, dtype=VERTEX_DTYPE)
+
+
+def encode_index_buffer(indices):
+    """Packs a sequence of vertex indices into one contiguous uint16 array."""
+    return np.ascontiguousarray(indices, dtype=INDEX_DTYPE)
+
+
+def transform_points(matrix, points):
+    """Applies a 4x4 matrix to an (n, 3) float32 array with the same rounding as `matrix @ Vector`.
+
+    mathutils multiplies in single precision and sums the products in double precision.
+    """
+    matrix = np.array(matrix, dtype=np.float32)
+    transformed = np.empty((len(points), 3), dtype=np.float32)
+    for row in range(3):
+        dot = (matrix[row, 0] * points[:, 0]).astype(np.float64)
+        dot += matrix[row, 1] * points[:, 1]
+        dot += matrix[row, 2] * points[:, 2]
+        dot += np.float64(matrix[row, 3])
+        transformed[:, row] = dot
+    return transformed
+
+
+def convert_vectors3(vectors):
+    """Array version of exporter_utils.convert_vector3."""
+    return np.stack((vectors[:, 0], vectors[:, 2], -vectors[:, 1]), axis=1)
+
+
+def weld_vertices(columns, tolerances=None):
+    """Merges equal vertices given as a list of per-vertex attribute arrays.
+
+    Attributes with a tolerance above zero are quantized to a grid of that size before
+    comparing, so nearly equal values merge. Values close to a grid line can still end
+    up in neighbouring cells. Every merged vertex keeps the values of its first occurrence.
+
+    Returns the index of the first occurrence of each welded vertex in first-seen order,
+    and for every input vertex the position of its welded vertex in that order.
+    """
+    keys = _pack_vertex_keys(columns, tolerances or (0.0,) * len(columns))
+    first_indices, inverse = _unique_keys(keys)
+    order = np.argsort(first_indices)
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order))
+    return first_indices[order], positions[inverse]
+
+
+def calculate_bounding_sphere(positions):
+    """Returns the center and radius of a near-minimal sphere enclosing all positions.
+
+    Starts from Ritter's sphere around an approximately most distant pair of points and
+    grows it to include the farthest outside point until none is left. The sphere around
+    the bounding box center is used instead when it happens to be smaller.
+    """
+    points = np.asarray(positions, dtype=np.float64)
+    first = points[np.argmax(_squared_distances(points, points[0]))]
+    second = points[np.argmax(_squared_distances(points, first))]
+    center = (first + second) / 2
+    radius = np.linalg.norm(second - first) / 2
+    for _ in range(BOUNDING_SPHERE_MAX_ITERATIONS):
+        distances = _squared_distances(points, center)
+        farthest = np.argmax(distances)
+        distance = np.sqrt(distances[farthest])
+        if distance <= radius:
+            break
+        # Move towards the outside point, keeping the opposite side of the sphere in place
+        new_radius = (radius + distance) / 2
+        center = center + (points[farthest] - center) * ((new_radius - radius) / distance)
+        radius = new_radius
+    radius = max(radius, np.sqrt(_squared_distances(points, center).max()))
+
+    box_center = (points.min(axis=0) + points.max(axis=0)) / 2
+    box_radius = np.sqrt(_squared_distances(points, box_center).max())
+    if box_radius < radius:
+        center, radius = box_center, box_radius
+    radius += BOUNDING_SPHERE_EPSILON * (np.abs(center).max() + radius)
+    return center.tolist(), float(radius)
+
+
+def calculate_legacy_bounding_sphere(positions):
+    """Returns the bounding box center and the largest box extent as radius, as older versions did."""
+    min_x, min_y, min_z = positions.min(axis=0).tolist()
+    max_x, max_y, max_z = positions.max(axis=0).tolist()
+
+    sphere_center = [
+        min_x + (max_x - min_x) / 2,
+        min_y + (max_y - min_y) / 2,
+        min_z + (max_z - min_z) / 2
+    ]
+    sphere_radius = max((max_x - min_x) / 2, (max_y - min_y) / 2, (max_z - min_z) / 2) * 2
+    return sphere_center, sphere_radius
+
+
+def _squared_distances(points, center):
+    offsets = points - center
+    return np.einsum("ij,ij->i", offsets, offsets)
+
+
+def split_triangles_spatially(positions, indices, vertex_limit):
+    """Splits triangles into compact groups that each use at most `vertex_limit` vertices.
+
+    Groups are halved at the median triangle centroid along their longest axis until
+    they fit. Every level of halving visits each triangle once, and there are about
+    log2(n / vertex_limit) levels, so the split takes O(n log n) time for n triangles.
+    Returns arrays of triangle numbers, neighbouring groups in space follow each other.
+    """
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    centroids = np.asarray(positions, dtype=np.float64)[triangles].mean(axis=1)
+    is_used = np.zeros(len(positions), dtype=np.bool_)
+    groups = []
+    pending = [np.arange(len(triangles))]
+    while pending:
+        group = pending.pop()
+        # Every write stores the same flag, so the count does not depend on the order of repeated indices
+        group_vertices = triangles[group].ravel()
+        is_used[group_vertices] = True
+        vertex_count = np.count_nonzero(is_used)
+        is_used[group_vertices] = False
+        if vertex_count <= vertex_limit:
+            groups.append(group)
+            continue
+        group_centroids = centroids[group]
+        axis = np.argmax(group_centroids.max(axis=0) - group_centroids.min(axis=0))
+        middle = len(group) // 2
+        order = np.argpartition(group_centroids[:, axis], middle)
+        pending.append(group[order[middle:]])
+        pending.append(group[order[:middle]])
+    return groups
+
+
+def _pack_vertex_keys(columns, tolerances):
+    """Packs each vertex into a fixed-width key of 64 bit words."""
+    row_count = len(columns[0])
+    keys = []
+    for column, tolerance in zip(columns, tolerances):
+        column = column.reshape(row_count, -1)
+        if tolerance > 0.0:
+            column = np.floor(column / tolerance + 0.5).astype(np.int64)
+        elif column.dtype.kind == "f":
+            # Adding zero turns -0.0 into 0.0, they compare equal
+            column = column + column.dtype.type(0)
+        keys.append(np.ascontiguousarray(column).view(np.uint8).reshape(row_count, -1))
+    key_bytes = sum(key.shape[1] for key in keys)
+    padding = -key_bytes % 8
+    if padding:
+        keys.append(np.zeros((row_count, padding), dtype=np.uint8))
+    return np.ascontiguousarray(np.concatenate(keys, axis=1)).view(np.uint64)
+
+
+def _unique_keys(keys):
+    """Returns the first index of each distinct key and the distinct key of every row.
+
+    Rows are reduced to a 64 bit hash for a single sorting pass. Hash collisions are
+    detected by comparing every row with its representative, and then resolved with
+    an exact comparison of the full keys.
+    """
+    hashes = np.zeros(len(keys), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for word in keys.T:
+            hashes ^= word
+            hashes *= HASH_MULTIPLIER
+            hashes ^= hashes >> np.uint64(29)
+    _unique_hashes, first_indices, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    if np.array_equal(keys[first_indices[inverse]], keys):
+        return first_indices, inverse
+    row_keys = keys.view(np.dtype((np.void, keys.shape[1] * keys.itemsize))).ravel()
+    _unique_rows, first_indices, inverse = np.unique(row_keys, return_index=True, return_inverse=True)
+    return first_indices, inverse.ravel()
@@ -14,26 +14,68 @@
 # Copyright (C) 2014  Thomas Hagnhofer
 
 
+import copy
+import hashlib
+import io
+import math
+import numbers
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 import bmesh
+import bpy
 from mathutils import Matrix
-from .exporter_utils import (
-    convert_matrix,
-    convert_vector3,
-    get_active_material_texture_slot,
+import numpy as np
+from .export_cache import hash_key
+from .export_scope import ExportScope
+from .export_statistics import ExportStatistics
+from .material_writer import MATERIAL_BLEND_MODE
+from .mesh_optimizer import (
+    count_vertex_cache_misses,
+    optimize_overdraw,
+    optimize_vertex_cache,
+    optimize_vertex_fetch,
 )
-from .kn5_writer import KN5Writer
+from .mesh_simplifier import simplify_mesh
+from .mesh_utils import (
+    calculate_bounding_sphere,
+    calculate_legacy_bounding_sphere,
+    convert_vectors3,
+    encode_index_buffer,
+    encode_vertex_buffer,
+    split_triangles_spatially,
+    transform_points,
+    weld_vertices,
+)
+from .scene_graph import SceneGraph
+from .settings_rules import NameRules
+from ..kn5.format import NODE_CLASS, VERTEX_DTYPE
+from ..kn5.reader import KN5Cursor, read_node
+from ..kn5.writer import KN5BufferedStream, KN5Writer
 from ..utils.constants import ASSETTO_CORSA_OBJECTS
 
 
 NODES = "nodes"
-
-NODE_CLASS = {
-    "Node" : 1,
-    "Mesh" : 2,
-    "SkinnedMesh" : 3,
-}
+WELDING = "welding"
+LODS = "lods"
+BATCHING = "batching"
+
+DEFAULT_BATCH_CELL_SIZE = 100.0
+DEFAULT_BATCH_MESH_VERTICES = 1000
+
+# Bump when the serialized mesh records change for the same input, to invalidate cached meshes
+MESH_CACHE_VERSION = 6
+
+MESH_FINGERPRINT_ATTRIBUTES = (
+    ("vertices", "co", np.float32, 3),
+    ("edges", "vertices", np.int32, 2),
+    ("edges", "use_edge_sharp", np.bool_, 1),
+    ("loops", "vertex_index", np.int32, 1),
+    ("polygons", "loop_start", np.int32, 1),
+    ("polygons", "loop_total", np.int32, 1),
+    ("polygons", "material_index", np.int32, 1),
+    ("polygons", "use_smooth", np.bool_, 1),
+)
 
 NODE_SETTINGS = (
     "lodIn",
@@ -43,61 +85,174 @@ NODE_SETTINGS = (
     "visible",
     "transparent",
     "renderable",
+    "optimizeVertexCache",
+    "optimizeOverdraw",
+    "tightBoundingSphere",
+    "chunkSize",
 )
 
 
 class NodeWriter(KN5Writer):
-    def __init__(self, file, context, settings, warnings, material_writer):
+    def __init__(self, file, context, settings, warnings, material_writer, mesh_cache=None, statistics=None,
+                 scope=None, measure_vertex_cache=False):
         super().__init__(file)
 
         self.context = context
         self.settings = settings
         self.warnings = warnings
         self.material_writer = material_writer
+        self.mesh_cache = mesh_cache
+        self.statistics = statistics or ExportStatistics()
+        self.scope = scope or ExportScope(context)
         self.scene = self.context.scene
-        self.node_settings = []
-        self.ac_objects = []
+        self.scene_graph = None
+        self.node_settings = NameRules()
+        self.lod_settings = NameRules()
+        self.batch_settings = None
+        self.batched_objects = set()
+        self.batches = []
+        self.ac_objects = None
+        self.weld_tolerances = None
+        self.measure_vertex_cache = measure_vertex_cache
+        self.vertex_cache_statistics = VertexCacheStatistics()
+        self.bounding_sphere_volumes = {}
+        self.prepared_mesh_nodes = {}
+        self.shared_meshes = {}
+        self.shared_divided_meshes = {}
+        self.extracted_meshes = {}
+        self.lod_executor = None
         self._init_assetto_corsa_objects()
         self._init_node_settings()
+        self._init_weld_tolerances()
 
     def _init_node_settings(self):
-        self.node_settings = []
+        self.node_settings = NameRules()
         if NODES in self.settings:
             for node_key in self.settings[NODES]:
-                self.node_settings.append(NodeSettings(self.settings, node_key))
+                self.node_settings.add(node_key, NodeSettings(self.settings, node_key))
+        self.lod_settings = NameRules()
+        if LODS in self.settings:
+            for node_key in self.settings[LODS]:
+                self.lod_settings.add(node_key, LodSettings(self.settings, node_key))
+        self.batch_settings = None
+        if BATCHING in self.settings:
+            self.batch_settings = BatchSettings(self.settings)
+
+    def _init_weld_tolerances(self):
+        welding = self.settings.get(WELDING, {})
+        for attribute, tolerance in welding.items():
+            if attribute not in VERTEX_DTYPE.names:
+                raise Exception(f"Unknown welding attribute '{attribute}', use one of {', '.join(VERTEX_DTYPE.names)}")
+            if not isinstance(tolerance, numbers.Number) or tolerance < 0:
+                raise Exception(f"Welding tolerance for '{attribute}' must be a float of at least 0")
+        self.weld_tolerances = tuple(float(welding.get(attribute, 0.0)) for attribute in VERTEX_DTYPE.names)
 
     def _init_assetto_corsa_objects(self):
-        for obj_name in ASSETTO_CORSA_OBJECTS:
-            self.ac_objects.append(re.compile(f"^{obj_name}$"))
+        self.ac_objects = re.compile(f"^(?:{'|'.join(ASSETTO_CORSA_OBJECTS)})$")
 
     def _is_ac_object(self, name):
-        for regex in self.ac_objects:
-            if regex.match(name):
-                return True
-        return False
+        return self.ac_objects.match(name) is not None
 
     def write(self):
-        self._write_base_node(None, "BlenderFile")
-        for obj in sorted(self.context.blend_data.objects, key=lambda k: len(k.children)):
-            if not obj.parent:
+        self.scene_graph = SceneGraph(self.scope.objects)
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            self.lod_executor = executor
+            with self.statistics.measure_phase("lod_preparation"):
+                self._prepare_lod_mesh_nodes()
+            with self.statistics.measure_phase("batching"):
+                self._prepare_batches()
+            self._write_base_node(None, "BlenderFile")
+            for obj in self.scene_graph.get_exported_roots():
                 self._write_object(obj)
+            for node_properties, mesh in self.batches:
+                with self.statistics.measure_object(node_properties.name):
+                    if node_properties.optimizeVertexCache or node_properties.optimizeOverdraw:
+                        mesh = self._optimize_mesh(mesh, node_properties)
+                    self._write_mesh(mesh, node_properties)
+                    self.statistics.add_mesh(node_properties.name, len(mesh.vertices), len(mesh.indices) // 3)
+
+    def _prepare_lod_mesh_nodes(self):
+        """Prepares all objects with LODs up front, so their LODs are generated in parallel while nodes are written."""
+        if not self.lod_settings:
+            return
+        for obj in self.scene_graph.objects:
+            if obj.type == "MESH" and self.scene_graph.is_exported(obj):
+                node_properties = self._get_node_properties(obj)
+                if node_properties.lods:
+                    with self.statistics.measure_object(obj.name_full):
+                        self.prepared_mesh_nodes[obj.name_full] = self._prepare_mesh_node(obj, node_properties)
+
+    def _prepare_batches(self):
+        """Merges the meshes of small static objects per grid cell, material and node properties."""
+        if not self.batch_settings:
+            return
+        groups = {}
+        for obj in sorted(self.scene_graph.objects, key=lambda k: k.name_full):
+            if not self._is_batchable(obj):
+                continue
+            node_properties = self._get_node_properties(obj)
+            # Chunks are written as nodes of their own, so chunked objects are not batched
+            if node_properties.lods or node_properties.chunkSize > 0:
+                continue
+            with self.statistics.measure_object(obj.name_full):
+                meshes = self._split_object_by_materials(obj)
+            if sum(len(mesh.vertices) for mesh in meshes) > self.batch_settings.maxMeshVertices:
+                # Shared meshes are kept by _get_shared_meshes already
+                if self._get_shared_mesh_key(obj, node_properties.chunkSize) is None:
+                    self.extracted_meshes[obj.name_full] = meshes
+                continue
+            self.batched_objects.add(obj.name_full)
+            positions = np.concatenate([mesh.vertices["position"] for mesh in meshes])
+            center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+            # Cells span the horizontal X and Z axes of the converted coordinates
+            cell = tuple(np.floor(center[[0, 2]] / self.batch_settings.cellSize).astype(np.int64).tolist())
+            batch_properties = repr(sorted((k, v) for k, v in vars(node_properties).items() if k != "name"))
+            for mesh in meshes:
+                groups.setdefault((cell, mesh.material_id, batch_properties), []).append((node_properties, mesh))
+
+        self.batches = []
+        for mesh_nodes in groups.values():
+            batch = []
+            vertex_count = 0
+            for node_properties, mesh in mesh_nodes:
+                if batch and vertex_count + len(mesh.vertices) > 2**16:
+                    self._add_batch(batch)
+                    batch = []
+                    vertex_count = 0
+                batch.append((node_properties, mesh))
+                vertex_count += len(mesh.vertices)
+            self._add_batch(batch)
+
+    def _is_batchable(self, obj):
+        if obj.type != "MESH" or obj.parent or self.scene_graph.children[obj.name_full] or obj.animation_data:
+            return False
+        if obj.name.startswith("__") or not self.batch_settings.matches(obj.name):
+            return False
+        # Welded meshes have at least as many vertices as the original, skips large ones before extracting them
+        return len(obj.data.vertices) <= self.batch_settings.maxMeshVertices
+
+    def _add_batch(self, mesh_nodes):
+        first_properties, first_mesh = mesh_nodes[0]
+        batch_properties = copy.copy(first_properties)
+        batch_properties.name = f"{first_properties.name}_BATCH{len(self.batches)}"
+        vertex_offsets = np.cumsum([0] + [len(mesh.vertices) for _properties, mesh in mesh_nodes[:-1]])
+        vertices = np.concatenate([mesh.vertices for _properties, mesh in mesh_nodes])
+        indices = np.concatenate([
+            mesh.indices + vertex_offset for (_properties, mesh), vertex_offset in zip(mesh_nodes, vertex_offsets)
+        ])
+        self.batches.append((batch_properties, Mesh(first_mesh.material_id, vertices, indices)))
 
     def _write_object(self, obj):
-        if not obj.name.startswith("__"):
-            if obj.type == "MESH":
-                if obj.children:
-                    raise Exception(f"A mesh cannot contain children ('{obj.name}')")
-                self._write_mesh_node(obj)
-            else:
-                self._write_base_node(obj, obj.name)
-            for child in obj.children:
-                self._write_object(child)
-
-    def _any_child_is_mesh(self, obj):
-        for child in obj.children:
-            if child.type in ["MESH", "CURVE"] or self._any_child_is_mesh(child):
-                return True
-        return False
+        if obj.name_full in self.batched_objects:
+            return
+        if obj.type == "MESH":
+            if self.scene_graph.children[obj.name_full]:
+                raise Exception(f"A mesh cannot contain children ('{obj.name}')")
+            self._write_mesh_node(obj)
+        else:
+            self._write_base_node(obj, obj.name)
+        for child in self.scene_graph.exported_children[obj.name_full]:
+            self._write_object(child)
 
     def _write_base_node(self, obj, node_name):
         node_data = {}
@@ -105,18 +260,15 @@ class NodeWriter(KN5Writer):
         num_children = 0
         if not obj:
             matrix = Matrix()
-            for obj in self.context.blend_data.objects:
-                if not obj.parent and not obj.name.startswith("__"):
-                    num_children += 1
+            num_children = len(self.scene_graph.get_exported_roots())
+            num_children += len(self.batches) - len(self.batched_objects)
         else:
-            if not self._is_ac_object(obj.name) and not self._any_child_is_mesh(obj):
+            if not self._is_ac_object(obj.name) and not self.scene_graph.has_mesh_descendant(obj):
                 msg = f"Unknown logical object '{obj.name}' might prevent other objects from loading.{os.linesep}"
                 msg += "\tRename it to '__{obj.name}' if you do not want to export it."
                 self.warnings.append(msg)
-            matrix = convert_matrix(obj.matrix_local)
-            for child in obj.children:
-                if not child.name.startswith("__"):
-                    num_children += 1
+            matrix = self.scene_graph.local_matrices[obj.name_full]
+            num_children = len(self.scene_graph.exported_children[obj.name_full])
 
         node_data["name"] = node_name
         node_data["childCount"] = num_children
@@ -132,30 +284,226 @@ class NodeWriter(KN5Writer):
         self.write_matrix(node_data["transform"])
 
     def _write_mesh_node(self, obj):
-        divided_meshes = self._split_object_by_materials(obj)
-        divided_meshes = self._split_meshes_for_vertex_limit(divided_meshes)
-        if obj.parent or len(divided_meshes) > 1:
+        with self.statistics.measure_object(obj.name_full):
+            self._write_prepared_mesh_node(obj)
+
+    def _write_prepared_mesh_node(self, obj):
+        prepared = self.prepared_mesh_nodes.pop(obj.name_full, None)
+        if not prepared:
+            prepared = self._prepare_mesh_node(obj, self._get_node_properties(obj))
+        if prepared.mesh_records is not None:
+            mesh_count, mesh_records = prepared.mesh_count, prepared.mesh_records
+            self._add_cached_mesh_statistics(obj, prepared)
+        else:
+            mesh_nodes = self._get_prepared_mesh_nodes(prepared)
+            for _node_properties, mesh in mesh_nodes:
+                self.statistics.add_mesh(obj.name_full, len(mesh.vertices), len(mesh.indices) // 3)
+            if not prepared.cache_key:
+                self._write_mesh_parent_node(obj, len(mesh_nodes))
+                for node_properties, mesh in mesh_nodes:
+                    self._write_mesh(mesh, node_properties)
+                return
+            mesh_count = len(mesh_nodes)
+            mesh_records = self._serialize_meshes(mesh_nodes)
+            self.mesh_cache.store(prepared.cache_key, prepared.fingerprint, mesh_count, mesh_records)
+        self._write_mesh_parent_node(obj, mesh_count)
+        self.file.write(mesh_records)
+
+    def _get_node_properties(self, obj):
+        node_properties = NodeProperties(obj)
+        for node_setting in self.node_settings.resolve(obj.name):
+            node_setting.apply_settings_to_node(node_properties)
+        for lod_setting in self.lod_settings.resolve(obj.name):
+            lod_setting.apply_settings_to_node(node_properties)
+        return node_properties
+
+    def _prepare_mesh_node(self, obj, node_properties):
+        """Loads the mesh records of an object from the cache, or extracts its meshes and starts generating LODs."""
+        prepared = PreparedMeshNode(node_properties)
+        extracted_meshes = self.extracted_meshes.pop(obj.name_full, None)
+        if self.mesh_cache and not obj.data.is_editmode:
+            prepared.cache_key = hash_key(self.context.blend_data.filepath, obj.name_full)
+            prepared.fingerprint = self._get_mesh_fingerprint(obj, node_properties)
+            cached = self.mesh_cache.load(prepared.cache_key, prepared.fingerprint)
+            if cached:
+                prepared.mesh_count, prepared.mesh_records = cached
+                return prepared
+        divided_meshes = self._get_divided_meshes(obj, node_properties, extracted_meshes)
+        prepared.mesh_nodes = [(self._get_chunk_properties(node_properties, mesh), mesh) for mesh in divided_meshes]
+        for level, lod in enumerate(node_properties.lods, 1):
+            for mesh_properties, mesh in prepared.mesh_nodes:
+                lod_properties = copy.copy(mesh_properties)
+                lod_properties.name = f"{mesh_properties.name}_LOD{level}"
+                lod_properties.lodIn = lod["lodIn"]
+                lod_properties.lodOut = lod["lodOut"]
+                future = self.lod_executor.submit(simplify_mesh, mesh.vertices, mesh.indices, lod["ratio"])
+                prepared.lod_meshes.append((lod_properties, mesh.material_id, future))
+        return prepared
+
+    @staticmethod
+    def _get_chunk_properties(node_properties, mesh):
+        if mesh.chunk is None:
+            return node_properties
+        chunk_properties = copy.copy(node_properties)
+        chunk_properties.name = f"{node_properties.name}_{mesh.chunk[0]}_{mesh.chunk[1]}"
+        return chunk_properties
+
+    def _get_prepared_mesh_nodes(self, prepared):
+        mesh_nodes = list(prepared.mesh_nodes)
+        for lod_properties, material_id, future in prepared.lod_meshes:
+            simplified = future.result()
+            if not simplified:
+                continue
+            vertices, indices = simplified
+            mesh = Mesh(material_id, vertices, indices)
+            if lod_properties.optimizeVertexCache or lod_properties.optimizeOverdraw:
+                mesh = self._optimize_mesh(mesh, lod_properties)
+            mesh_nodes.append((lod_properties, mesh))
+        return mesh_nodes
+
+    def _get_divided_meshes(self, obj, node_properties, extracted_meshes=None):
+        """Meshes of an object within the vertex limit, `extracted_meshes` skips extracting unshared ones again."""
+        shared_key = self._get_shared_mesh_key(obj, node_properties.chunkSize)
+        if shared_key is None:
+            if extracted_meshes is None:
+                extracted_meshes = self._split_object_by_materials(obj, node_properties.chunkSize)
+            return self._divide_meshes(extracted_meshes, node_properties)
+        divided_key = (
+            shared_key,
+            node_properties.optimizeVertexCache,
+            node_properties.optimizeOverdraw,
+            node_properties.transparent,
+        )
+        if divided_key not in self.shared_divided_meshes:
+            self.shared_divided_meshes[divided_key] = self._divide_meshes(
+                self._get_shared_meshes(obj, shared_key), node_properties)
+        return self._transform_meshes(self.shared_divided_meshes[divided_key], obj.matrix_world)
+
+    def _divide_meshes(self, meshes, node_properties):
+        divided_meshes = self._split_meshes_for_vertex_limit(meshes)
+        if node_properties.optimizeVertexCache or node_properties.optimizeOverdraw:
+            divided_meshes = [self._optimize_mesh(mesh, node_properties) for mesh in divided_meshes]
+        return divided_meshes
+
+    def _optimize_mesh(self, mesh, node_properties):
+        """Reorders triangles for the vertex cache and overdraw, then vertices in the order they are fetched."""
+        indices = mesh.indices
+        measure_vertex_cache = node_properties.optimizeVertexCache and self.measure_vertex_cache
+        if measure_vertex_cache:
+            misses_before = count_vertex_cache_misses(indices)
+        if node_properties.optimizeVertexCache:
+            indices = optimize_vertex_cache(indices, len(mesh.vertices))
+        if node_properties.optimizeOverdraw and self._is_blended_mesh(mesh, node_properties):
+            indices = optimize_overdraw(mesh.vertices["position"], indices)
+        vertices, indices = optimize_vertex_fetch(mesh.vertices, indices)
+        if measure_vertex_cache:
+            self.vertex_cache_statistics.add(
+                len(indices) // 3, len(vertices), misses_before, count_vertex_cache_misses(indices))
+        return Mesh(mesh.material_id, vertices, indices, mesh.chunk)
+
+    def _is_blended_mesh(self, mesh, node_properties):
+        if node_properties.transparent:
+            return True
+        material = self.material_writer.materials_by_position.get(mesh.material_id)
+        return material is not None and material.alphaBlendMode != MATERIAL_BLEND_MODE["Opaque"]
+
+    def _write_mesh_parent_node(self, obj, mesh_count):
+        if obj.parent or mesh_count > 1:
             node_data = {}
             node_data["name"] = obj.name
-            node_data["childCount"] = len(divided_meshes)
+            node_data["childCount"] = mesh_count
             node_data["active"] = True
             transform_matrix = Matrix()
             if obj.parent:
-                transform_matrix = convert_matrix(obj.parent.matrix_world.inverted())
+                transform_matrix = self.scene_graph.inverse_world_matrices[obj.parent.name_full]
             node_data["transform"] = transform_matrix
             self._write_base_node_data(node_data)
-        node_properties = NodeProperties(obj)
-        for node_setting in self.node_settings:
-            node_setting.apply_settings_to_node(node_properties)
-        for mesh in divided_meshes:
-            self._write_mesh(obj, mesh, node_properties)
+
+    def _serialize_meshes(self, mesh_nodes):
+        output_stream = self.file
+        records = io.BytesIO()
+        self.file = KN5BufferedStream(records)
+        try:
+            for node_properties, mesh in mesh_nodes:
+                self._write_mesh(mesh, node_properties)
+            self.file.flush()
+        finally:
+            self.file = output_stream
+        return records.getvalue()
+
+    def _add_cached_mesh_statistics(self, obj, prepared):
+        self.statistics.get_object(obj.name_full)["cached"] = True
+        cursor = KN5Cursor(memoryview(prepared.mesh_records))
+        for _ in range(prepared.mesh_count):
+            mesh_node = read_node(cursor)
+            self.statistics.add_mesh(obj.name_full, len(mesh_node.vertices), len(mesh_node.indices) // 3)
+            if prepared.node_properties.tightBoundingSphere:
+                self._add_bounding_sphere_volumes(
+                    mesh_node.name, mesh_node.vertices["position"], mesh_node.bounding_sphere_radius)
+
+    def _get_mesh_fingerprint(self, obj, node_properties):
+        """Hashes everything the serialized mesh records of an object depend on."""
+        mesh = obj.data
+        fingerprint = hashlib.blake2b(digest_size=32)
+        object_state = (
+            MESH_CACHE_VERSION,
+            bpy.app.version,
+            obj.name_full,
+            [tuple(row) for row in obj.matrix_world],
+            tuple(obj.dimensions),
+            sorted(vars(node_properties).items()),
+            # Shared meshes are welded in object space, the others in world space
+            self._get_shared_mesh_key(obj, node_properties.chunkSize) is not None,
+            self.weld_tolerances,
+            mesh.use_auto_smooth,
+            mesh.auto_smooth_angle,
+            mesh.uv_layers.active.name if mesh.uv_layers.active else None,
+            [self._get_material_state(slot.material) for slot in obj.material_slots],
+            [self._get_material_state(material) for material in mesh.materials],
+        )
+        fingerprint.update(repr(object_state).encode("utf-8"))
+        for collection_name, attribute, dtype, width in MESH_FINGERPRINT_ATTRIBUTES:
+            collection = getattr(mesh, collection_name)
+            values = np.empty(len(collection) * width, dtype=dtype)
+            collection.foreach_get(attribute, values)
+            fingerprint.update(values)
+        if mesh.uv_layers.active:
+            uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+            mesh.uv_layers.active.data.foreach_get("uv", uvs)
+            fingerprint.update(uvs)
+        if mesh.has_custom_normals:
+            mesh.calc_normals_split()
+            normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+            mesh.loops.foreach_get("normal", normals)
+            fingerprint.update(normals)
+        return fingerprint.digest()
+
+    def _get_material_state(self, material):
+        if not material:
+            return None
+        texture_mapping = None
+        texture_node = self.scope.material_index.get_active_texture_node(material)
+        if texture_node:
+            texture_mapping = (
+                tuple(texture_node.texture_mapping.scale),
+                tuple(texture_node.texture_mapping.translation),
+            )
+        alpha_blend_mode = None
+        if material.name_full in self.material_writer.available_materials:
+            alpha_blend_mode = self.material_writer.available_materials[material.name_full].alphaBlendMode
+        return (
+            material.name_full,
+            self.material_writer.material_positions.get(material.name_full),
+            alpha_blend_mode,
+            texture_mapping,
+        )
 
     def _write_node_class(self, node_class):
         self.write_uint(NODE_CLASS[node_class])
 
-    def _write_mesh(self, obj, mesh, node_properties):
+    def _write_mesh(self, mesh, node_properties):
         self._write_node_class("Mesh")
-        self.write_string(obj.name)
+        self.write_string(node_properties.name)
         self.write_uint(0) # Child count, none allowed
         is_active = True
         self.write_bool(is_active)
@@ -163,59 +511,81 @@ class NodeWriter(KN5Writer):
         self.write_bool(node_properties.visible)
         self.write_bool(node_properties.transparent)
         if len(mesh.vertices) > 2**16:
-            raise Exception(f"Only {2**16} vertices per mesh allowed. ('{obj.name}')")
+            raise Exception(f"Only {2**16} vertices per mesh allowed. ('{node_properties.name}')")
         self.write_uint(len(mesh.vertices))
-        for vertex in mesh.vertices:
-            self.write_vector3(vertex.co)
-            self.write_vector3(vertex.normal)
-            self.write_vector2(vertex.uv)
-            self.write_vector3(vertex.tangent)
+        self.write_array(encode_vertex_buffer(mesh.vertices))
         self.write_uint(len(mesh.indices))
-        for i in mesh.indices:
-            self.write_ushort(i)
+        self.write_array(encode_index_buffer(mesh.indices))
         if mesh.material_id is None:
-            self.warnings.append(f"No material to mesh '{obj.name}' assigned")
+            self.warnings.append(f"No material to mesh '{node_properties.name}' assigned")
             self.write_uint(0)
         else:
             self.write_uint(mesh.material_id)
         self.write_uint(node_properties.layer) #Layer
         self.write_float(node_properties.lodIn) #LOD In
         self.write_float(node_properties.lodOut) #LOD Out
-        self._write_bounding_sphere(mesh.vertices)
+        self._write_bounding_sphere(mesh.vertices, node_properties)
         self.write_bool(node_properties.renderable) #isRenderable
 
-    def _write_bounding_sphere(self, vertices):
-        max_x = -999999999
-        max_y = -999999999
-        max_z = -999999999
-        min_x = 999999999
-        min_y = 999999999
-        min_z = 999999999
-        for vertex in vertices:
-            co = vertex.co
-            if co[0] > max_x:
-                max_x = co[0]
-            if co[0] < min_x:
-                min_x = co[0]
-            if co[1] > max_y:
-                max_y = co[1]
-            if co[1] < min_y:
-                min_y = co[1]
-            if co[2] > max_z:
-                max_z = co[2]
-            if co[2] < min_z:
-                min_z = co[2]
-
-        sphere_center = [
-            min_x + (max_x - min_x) / 2,
-            min_y + (max_y - min_y) / 2,
-            min_z + (max_z - min_z) / 2
-        ]
-        sphere_radius = max((max_x - min_x) / 2, (max_y - min_y) / 2, (max_z - min_z) / 2) * 2
+    def _write_bounding_sphere(self, vertices, node_properties):
+        positions = vertices["position"]
+        if node_properties.tightBoundingSphere:
+            sphere_center, sphere_radius = calculate_bounding_sphere(positions)
+            self._add_bounding_sphere_volumes(node_properties.name, positions, sphere_radius)
+        else:
+            sphere_center, sphere_radius = calculate_legacy_bounding_sphere(positions)
         self.write_vector3(sphere_center)
         self.write_float(sphere_radius)
 
-    def _split_object_by_materials(self, obj):
+    def _add_bounding_sphere_volumes(self, node_name, positions, sphere_radius):
+        """Sums the volumes of the legacy and the written bounding spheres of each node."""
+        _legacy_center, legacy_radius = calculate_legacy_bounding_sphere(positions)
+        volumes = self.bounding_sphere_volumes.setdefault(node_name, [0.0, 0.0])
+        volumes[0] += 4 / 3 * math.pi * legacy_radius ** 3
+        volumes[1] += 4 / 3 * math.pi * sphere_radius ** 3
+
+    def _split_object_by_materials(self, obj, chunk_size=0.0):
+        shared_key = self._get_shared_mesh_key(obj, chunk_size)
+        if shared_key is None:
+            return self._extract_meshes(obj, chunk_size)
+        return self._transform_meshes(self._get_shared_meshes(obj, shared_key), obj.matrix_world)
+
+    @staticmethod
+    def _get_shared_mesh_key(obj, chunk_size):
+        """Key of the object space meshes of a mesh datablock, None if they can't be shared between its users.
+
+        Planar UVs and chunks depend on the world positions, so only meshes with a UV map
+        and without chunking are shared. Welding tolerances apply in object space for them.
+        """
+        mesh = obj.data
+        if mesh.users < 2 or chunk_size > 0 or not mesh.uv_layers.active:
+            return None
+        return (
+            mesh.name_full,
+            tuple(slot.material.name_full if slot.material else None for slot in obj.material_slots),
+        )
+
+    def _get_shared_meshes(self, obj, shared_key):
+        if shared_key not in self.shared_meshes:
+            self.shared_meshes[shared_key] = self._extract_meshes(obj, object_space=True)
+        return self.shared_meshes[shared_key]
+
+    @staticmethod
+    def _transform_meshes(meshes, matrix_world):
+        """Copies object space meshes with their positions in converted world space."""
+        transformed_meshes = []
+        for mesh in meshes:
+            vertices = mesh.vertices.copy()
+            vertices["position"] = convert_vectors3(transform_points(matrix_world, mesh.vertices["position"]))
+            transformed_meshes.append(Mesh(mesh.material_id, vertices, mesh.indices, mesh.chunk))
+        return transformed_meshes
+
+    def _extract_meshes(self, obj, chunk_size=0.0, object_space=False):
+        """Triangulated and welded meshes per material and chunk of an object.
+
+        With `object_space`, positions are left in Blender object space to be placed
+        with _transform_meshes, and the object must not need chunks or planar UVs.
+        """
         meshes = []
         mesh_copy = obj.to_mesh()
 
@@ -227,96 +597,144 @@ class NodeWriter(KN5Writer):
 
         try:
             mesh_copy.calc_loop_triangles()
-            mesh_copy.calc_tangents()
-            mesh_vertices = mesh_copy.vertices[:]
-            mesh_loops = mesh_copy.loops[:]
-            mesh_triangles = mesh_copy.loop_triangles[:]
             uv_layer = mesh_copy.uv_layers.active
-            matrix = obj.matrix_world
+            # Tangents can only be calculated from a UV map, planar UVs get their tangents below
+            if uv_layer:
+                mesh_copy.calc_tangents()
+            else:
+                mesh_copy.calc_normals_split()
 
             if not mesh_copy.materials:
                 raise Exception(f"Object '{obj.name}' has no material assigned")
 
-            used_materials = set([triangle.material_index for triangle in mesh_triangles])
-            for material_index in used_materials:
+            triangle_count = len(mesh_copy.loop_triangles)
+            triangle_loops = np.empty(triangle_count * 3, dtype=np.int32)
+            mesh_copy.loop_triangles.foreach_get("loops", triangle_loops)
+            triangle_loops = triangle_loops.reshape(triangle_count, 3)
+            triangle_materials = np.empty(triangle_count, dtype=np.int32)
+            mesh_copy.loop_triangles.foreach_get("material_index", triangle_materials)
+
+            loop_count = len(mesh_copy.loops)
+            loop_vertices = np.empty(loop_count, dtype=np.int32)
+            mesh_copy.loops.foreach_get("vertex_index", loop_vertices)
+            object_normals = np.empty(loop_count * 3, dtype=np.float32)
+            mesh_copy.loops.foreach_get("normal", object_normals)
+            object_normals = object_normals.reshape(loop_count, 3)
+            loop_normals = convert_vectors3(object_normals)
+            loop_tangents = None
+            loop_uvs = None
+            if uv_layer:
+                loop_tangents = np.empty(loop_count * 3, dtype=np.float32)
+                mesh_copy.loops.foreach_get("tangent", loop_tangents)
+                loop_tangents = loop_tangents.reshape(loop_count, 3)
+                loop_uvs = np.empty(loop_count * 2, dtype=np.float32)
+                uv_layer.data.foreach_get("uv", loop_uvs)
+                loop_uvs = loop_uvs.reshape(loop_count, 2)
+                loop_uvs[:, 1] *= -1
+
+            positions = np.empty(len(mesh_copy.vertices) * 3, dtype=np.float32)
+            mesh_copy.vertices.foreach_get("co", positions)
+            if object_space:
+                world_positions = None
+                converted_positions = positions.reshape(-1, 3)
+            else:
+                world_positions = transform_points(obj.matrix_world, positions.reshape(-1, 3))
+                converted_positions = convert_vectors3(world_positions)
+
+            for material_index in set(triangle_materials.tolist()):
                 if not mesh_copy.materials[material_index]:
                     raise Exception(f"Material slot {material_index} for object '{obj.name}' has no material assigned")
                 material_name = mesh_copy.materials[material_index].name
                 if material_name.startswith("__"):
                     raise Exception(f"Material '{material_name}' is ignored but is used by object '{obj.name}'")
 
-                vertices = {}
-                indices = []
-                for triangle in mesh_triangles:
-                    if material_index != triangle.material_index:
-                        continue
-                    vertex_index_for_face = 0
-                    face_indices = []
-                    for loop_index in triangle.loops:
-                        loop = mesh_loops[loop_index]
-                        local_position = matrix @ mesh_vertices[loop.vertex_index].co
-                        converted_position = convert_vector3(local_position)
-                        converted_normal = convert_vector3(loop.normal)
-                        uv = (0, 0)
-                        if uv_layer:
-                            uv = uv_layer.data[loop_index].uv
-                            uv = (uv[0], -uv[1])
-                        else:
-                            uv = self._calculate_uvs(obj, mesh_copy, material_index, local_position)
-                        tangent = loop.tangent
-                        vertex = UvVertex(converted_position, converted_normal, uv, tangent)
-                        if vertex not in vertices:
-                            new_index = len(vertices)
-                            vertices[vertex] = new_index
-                        face_indices.append(vertices[vertex])
-                        vertex_index_for_face += 1
-                    indices.extend((face_indices[1], face_indices[2], face_indices[0]))
-                    if len(face_indices) == 4:
-                        indices.extend((face_indices[2], face_indices[3], face_indices[0]))
-                vertices = [v for v, index in sorted(vertices.items(), key=lambda k: k[1])]
-                material_id = self.material_writer.material_positions[material_name]
-                meshes.append(Mesh(material_id, vertices, indices))
+            chunks = self._get_chunk_triangles(world_positions, loop_vertices, triangle_loops, chunk_size)
+            for chunk, chunk_triangles in chunks:
+                chunk_loops = triangle_loops[chunk_triangles]
+                chunk_materials = triangle_materials[chunk_triangles]
+                # Built from the triangles in order, so materials are visited in the same order as before
+                used_materials = set(chunk_materials.tolist())
+                for material_index in used_materials:
+                    material_name = mesh_copy.materials[material_index].name_full
+                    loops = chunk_loops[chunk_materials == material_index].ravel()
+                    vertex_indices = loop_vertices[loops]
+                    if loop_uvs is not None:
+                        uvs = loop_uvs[loops]
+                        tangents = loop_tangents[loops]
+                    else:
+                        material = mesh_copy.materials[material_index]
+                        uvs = self._calculate_planar_uvs(obj, material, world_positions[vertex_indices])
+                        tangents = self._calculate_planar_tangents(obj, material, object_normals[loops])
+                    attributes = (
+                        converted_positions[vertex_indices],
+                        loop_normals[loops],
+                        uvs,
+                        tangents,
+                    )
+                    first_loops, loop_indices = weld_vertices(attributes, self.weld_tolerances)
+                    vertices = np.empty(len(first_loops), dtype=VERTEX_DTYPE)
+                    for field, values in zip(VERTEX_DTYPE.names, attributes):
+                        vertices[field] = values[first_loops]
+                    indices = loop_indices.reshape(-1, 3)[:, (1, 2, 0)].ravel()
+                    material_id = self.material_writer.material_positions[material_name]
+                    meshes.append(Mesh(material_id, vertices, indices, chunk))
         finally:
             obj.to_mesh_clear()
         return meshes
 
+    @staticmethod
+    def _get_chunk_triangles(world_positions, loop_vertices, triangle_loops, chunk_size):
+        """Groups triangles by the cell of a world grid on the X and Y axes their centroid lies in."""
+        if chunk_size <= 0:
+            return [(None, slice(None))]
+        centroids = world_positions[loop_vertices[triangle_loops]].mean(axis=1)
+        cells = np.floor(centroids[:, :2] / chunk_size).astype(np.int64)
+        unique_cells, triangle_cells = np.unique(cells, axis=0, return_inverse=True)
+        triangle_cells = triangle_cells.ravel()
+        order = np.argsort(triangle_cells, kind="stable")
+        boundaries = np.flatnonzero(np.diff(triangle_cells[order])) + 1
+        return list(zip(map(tuple, unique_cells.tolist()), np.split(order, boundaries)))
+
     def _split_meshes_for_vertex_limit(self, divided_meshes):
         new_meshes = []
         limit = 2**16
         for mesh in divided_meshes:
             if len(mesh.vertices) > limit:
-                start_index = 0
-                while start_index < len(mesh.indices):
-                    vertex_index_mapping = {}
-                    new_indices = []
-                    for i in range(start_index, len(mesh.indices), 3):
-                        start_index += 3
-                        face = mesh.indices[i:i+3]
-                        for face_index in face:
-                            if not face_index in vertex_index_mapping:
-                                new_index = len(vertex_index_mapping)
-                                vertex_index_mapping[face_index] = new_index
-                            new_indices.append(vertex_index_mapping[face_index])
-                        if len(vertex_index_mapping) >= limit-3:
-                            break
-                    verts = [mesh.vertices[v] for v, index in sorted(vertex_index_mapping.items(), key=lambda k: k[1])]
-                    new_meshes.append(Mesh(mesh.material_id, verts, new_indices))
+                triangles = mesh.indices.reshape(-1, 3)
+                for group in split_triangles_spatially(mesh.vertices["position"], mesh.indices, limit):
+                    used_vertices, indices = np.unique(triangles[group], return_inverse=True)
+                    new_meshes.append(Mesh(mesh.material_id, mesh.vertices[used_vertices], indices.ravel(), mesh.chunk))
             else:
                 new_meshes.append(mesh)
         return new_meshes
 
-    def _calculate_uvs(self, obj, mesh, material_id, co):
-        size = obj.dimensions
-        x = co[0] / size[0]
-        y = co[1] / size[1]
-        mat = mesh.materials[material_id]
-        texture_node = get_active_material_texture_slot(mat)
-        if texture_node:
-            x *= texture_node.texture_mapping.scale[0]
-            y *= texture_node.texture_mapping.scale[1]
-            x += texture_node.texture_mapping.translation[0]
-            y += texture_node.texture_mapping.translation[1]
-        return (x, y)
+    def _calculate_planar_uvs(self, obj, material, world_positions):
+        """Maps the world X and Y axes over the object dimensions, with the mapping of the active texture."""
+        material_textures = self.scope.material_index.get(material)
+        size = np.array(obj.dimensions[:2], dtype=np.float64)
+        # Flat objects would divide by zero, their UVs along that axis are constant anyway
+        size[size == 0.0] = 1.0
+        uvs = world_positions[:, :2].astype(np.float64) / size
+        uvs *= material_textures.mapping_scale
+        uvs += material_textures.mapping_translation
+        return uvs
+
+    def _calculate_planar_tangents(self, obj, material, object_normals):
+        """Tangents along increasing U of planar UVs, in object space like Mesh.calc_tangents."""
+        material_textures = self.scope.material_index.get(material)
+        world_to_object = np.array(obj.matrix_world.to_3x3().inverted_safe(), dtype=np.float64)
+        u_axis = world_to_object[:, 0] * (-1.0 if material_textures.mapping_scale[0] < 0 else 1.0)
+        v_axis = world_to_object[:, 1]
+        normals = object_normals.astype(np.float64)
+        tangents = u_axis - normals * (normals @ u_axis)[:, None]
+        lengths = np.linalg.norm(tangents, axis=1)
+        # Faces perpendicular to the world X axis have no U direction, use V instead
+        degenerate = lengths < 1e-6
+        if degenerate.any():
+            tangents[degenerate] = v_axis - normals[degenerate] * (normals[degenerate] @ v_axis)[:, None]
+            lengths[degenerate] = np.linalg.norm(tangents[degenerate], axis=1)
+        lengths[lengths == 0.0] = 1.0
+        return tangents / lengths[:, None]
 
 
 class NodeProperties:
@@ -330,88 +748,130 @@ class NodeProperties:
         self.visible = ac_node.visible
         self.transparent = ac_node.transparent
         self.renderable = ac_node.renderable
+        self.optimizeVertexCache = False
+        self.optimizeOverdraw = False
+        self.tightBoundingSphere = True
+        self.lods = []
+        self.chunkSize = 0.0
 
 
 class NodeSettings:
+    """Node settings of a key of the nodes section, read and checked once.
+
+    Matching node names is left to the NameRules the settings are added to.
+    """
+
     def __init__(self, settings, node_settings_key):
-        self._settings = settings
         self._node_settings_key = node_settings_key
-        self._node_name_matches = self._convert_to_matches_list(node_settings_key)
+        node_settings = settings[NODES][node_settings_key]
+        if not isinstance(node_settings, dict):
+            raise Exception(f"Node settings for '{node_settings_key}' must be an object")
+        self._values = {}
+        for setting in NODE_SETTINGS:
+            setting_val = node_settings.get(setting)
+            if setting_val is None:
+                continue
+            if not isinstance(setting_val, numbers.Number):
+                raise Exception(f"Node setting '{setting}' for '{node_settings_key}' must be a number or boolean")
+            self._values[setting] = setting_val
 
     def apply_settings_to_node(self, node):
-        if not self._does_node_name_match(node.name):
-            return
-        for setting in NODE_SETTINGS:
-            setting_val = self._get_node_setting(setting)
-            if setting_val is not None:
-                setattr(node, setting, setting_val)
-
-    def _does_node_name_match(self, node_name):
-        for regex in self._node_name_matches:
-            if regex.match(node_name):
-                return True
-        return False
-
-    def _convert_to_matches_list(self, key):
-        matches = []
-        for subkey in key.split("|"):
-            matches.append(re.compile(f"^{self._escape_match_key(subkey)}$", re.IGNORECASE))
-        return matches
-
-    def _escape_match_key(self, key):
-        wildcard_replacement = "__WILDCARD__"
-        key = key.replace("*", wildcard_replacement)
-        key = re.escape(key)
-        key = key.replace(wildcard_replacement, ".*")
-        return key
-
-    def _get_node_setting(self, setting):
-        if setting in self._settings[NODES][self._node_settings_key]:
-            return self._settings[NODES][self._node_settings_key][setting]
-        return None
-
-
-class UvVertex:
-    def __init__(self, co, normal, uv, tangent):
-        self.co = co
-        self.normal = normal
-        self.uv = uv
-        self.tangent = tangent
-        self.hash = None
-
-    def __hash__(self):
-        if not self.hash:
-            self.hash = hash(
-                hash(self.co[0]) ^
-                hash(self.co[1]) ^
-                hash(self.co[2]) ^
-                hash(self.normal[0]) ^
-                hash(self.normal[1]) ^
-                hash(self.normal[2]) ^
-                hash(self.uv[0]) ^
-                hash(self.uv[1]) ^
-                hash(self.tangent[0]) ^
-                hash(self.tangent[1]) ^
-                hash(self.tangent[2])
-            )
-        return self.hash
+        for setting, setting_val in self._values.items():
+            setattr(node, setting, setting_val)
 
-    def __eq__(self, other):
-        if self.co[0] != other.co[0] or self.co[1] != other.co[1] or self.co[2] != other.co[2]:
-            return False
-        if self.normal[0] != other.normal[0] or self.normal[1] != other.normal[1] or self.normal[2] != other.normal[2]:
-            return False
-        if self.uv[0] != other.uv[0] or self.uv[1] != other.uv[1]:
-            return False
-        if (self.tangent[0] != other.tangent[0]
-                or self.tangent[1] != other.tangent[1]
-                or self.tangent[2] != other.tangent[2]):
-            return False
-        return True
+
+class LodSettings():
+    """LOD levels of the nodes matching a key of the LOD settings section."""
+
+    def __init__(self, settings, node_settings_key):
+        self._node_settings_key = node_settings_key
+        self._levels = settings[LODS][node_settings_key]
+        self._validate_levels()
+
+    def apply_settings_to_node(self, node):
+        node.lods = self._levels
+
+    def _validate_levels(self):
+        if not isinstance(self._levels, list):
+            raise Exception(f"LOD settings for '{self._node_settings_key}' must be a list of levels")
+        for level in self._levels:
+            ratio = level.get("ratio") if isinstance(level, dict) else None
+            if not isinstance(ratio, numbers.Number) or not 0 < ratio < 1:
+                raise Exception(f"LOD levels for '{self._node_settings_key}' need a triangle ratio between 0 and 1")
+            for setting in ("lodIn", "lodOut"):
+                if not isinstance(level.get(setting), numbers.Number):
+                    raise Exception(f"LOD levels for '{self._node_settings_key}' need a number for '{setting}'")
+
+
+class BatchSettings():
+    """Eligible node names and grid of the batching settings section."""
+
+    def __init__(self, settings):
+        batching = settings[BATCHING]
+        if not isinstance(batching.get("nodes"), str):
+            raise Exception("Batching settings need a 'nodes' pattern of the objects to batch")
+        self._node_names = NameRules()
+        self._node_names.add(batching["nodes"], True)
+        self.cellSize = batching.get("cellSize", DEFAULT_BATCH_CELL_SIZE)
+        self.maxMeshVertices = batching.get("maxMeshVertices", DEFAULT_BATCH_MESH_VERTICES)
+        if not isinstance(self.cellSize, numbers.Number) or self.cellSize <= 0:
+            raise Exception("Batching cell size must be a number above 0")
+        if not isinstance(self.maxMeshVertices, int) or self.maxMeshVertices < 1:
+            raise Exception("Batching maxMeshVertices must be a whole number above 0")
+
+    def matches(self, node_name):
+        return self._node_names.matches(node_name)
+
+
+class PreparedMeshNode:
+    """Either the cached mesh records of an object, or its meshes and the LOD meshes being generated."""
+
+    def __init__(self, node_properties):
+        self.node_properties = node_properties
+        self.cache_key = None
+        self.fingerprint = None
+        self.mesh_count = 0
+        self.mesh_records = None
+        self.mesh_nodes = []
+        self.lod_meshes = []
 
 
 class Mesh:
-    def __init__(self, material_id, vertices, indices):
+    """Vertices are a VERTEX_DTYPE array, indices an integer array of three per triangle.
+
+    Meshes of chunked objects know the X and Y coordinates of their grid cell.
+    """
+
+    def __init__(self, material_id, vertices, indices, chunk=None):
         self.material_id = material_id
         self.vertices = vertices
         self.indices = indices
+        self.chunk = chunk
+
+
+class VertexCacheStatistics:
+    """Vertices transformed by a simulated post-transform cache, before and after optimization.
+
+    ACMR is the average number of vertices transformed per triangle, ATVR the same number
+    relative to the vertex count, where 1.0 is the optimum.
+    """
+
+    def __init__(self):
+        self.mesh_count = 0
+        self.triangle_count = 0
+        self.vertex_count = 0
+        self.misses_before = 0
+        self.misses_after = 0
+
+    def add(self, triangle_count, vertex_count, misses_before, misses_after):
+        self.mesh_count += 1
+        self.triangle_count += triangle_count
+        self.vertex_count += vertex_count
+        self.misses_before += misses_before
+        self.misses_after += misses_after
+
+    def get_acmr(self):
+        return self.misses_before / self.triangle_count, self.misses_after / self.triangle_count
+
+    def get_atvr(self):
+        return self.misses_before / self.vertex_count, self.misses_after / self.vertex_count
@@ -0,0 +1,103 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import struct
+import zlib
+import numpy as np
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+PNG_COLOR_TYPES = {
+    1: 0, # Grayscale
+    2: 4, # Grayscale and alpha
+    3: 2, # RGB
+    4: 6, # RGBA
+}
+
+PNG_FILTER_PAETH = 4
+
+# Rows filtered and compressed at a time, bounds the temporary memory per image
+STRIP_ROWS = 256
+
+
+def encode_png(pixels, width, height, channels, compression_level=6, linear_to_srgb=False):
+    """Encodes float pixels as read from bpy.types.Image.pixels into PNG file bytes.
+
+    Runs without touching bpy, so it can be called from worker threads. The heavy
+    parts are NumPy and zlib calls, which release the GIL.
+    """
+    if channels not in PNG_COLOR_TYPES:
+        raise Exception(f"Unsupported channel count {channels} for PNG encoding")
+    # Blender stores the bottom row first, PNG the top row
+    image = np.asarray(pixels, dtype=np.float32).reshape(height, width, channels)[::-1]
+    color_channels = channels if channels in (1, 3) else channels - 1
+    compressor = zlib.compressobj(compression_level)
+    idat = []
+    previous_row = np.zeros(width * channels, dtype=np.uint8)
+    for start in range(0, height, STRIP_ROWS):
+        strip = _to_bytes(image[start:start + STRIP_ROWS], color_channels, linear_to_srgb)
+        strip = strip.reshape(strip.shape[0], width * channels)
+        idat.append(compressor.compress(_filter_paeth(strip, previous_row, channels)))
+        previous_row = strip[-1]
+    idat.append(compressor.flush())
+
+    header = struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return b"".join((
+        PNG_SIGNATURE,
+        _chunk(b"IHDR", header),
+        _chunk(b"IDAT", b"".join(idat)),
+        _chunk(b"IEND", b""),
+    ))
+
+
+def _to_bytes(strip, color_channels, linear_to_srgb):
+    strip = np.clip(strip, 0.0, 1.0)
+    if linear_to_srgb:
+        color = strip[..., :color_channels]
+        strip[..., :color_channels] = np.where(
+            color <= 0.0031308,
+            color * 12.92,
+            1.055 * np.power(color, 1.0 / 2.4) - 0.055)
+    return (strip * 255.0 + 0.5).astype(np.uint8)
+
+
+def _filter_paeth(strip, previous_row, bytes_per_pixel):
+    raw = strip.astype(np.int16)
+    up = np.empty_like(raw)
+    up[0] = previous_row
+    up[1:] = raw[:-1]
+    left = np.zeros_like(raw)
+    left[:, bytes_per_pixel:] = raw[:, :-bytes_per_pixel]
+    upper_left = np.zeros_like(raw)
+    upper_left[:, bytes_per_pixel:] = up[:, :-bytes_per_pixel]
+
+    estimate = left + up - upper_left
+    distance_left = np.abs(estimate - left)
+    distance_up = np.abs(estimate - up)
+    distance_upper_left = np.abs(estimate - upper_left)
+    predictor = np.where(
+        (distance_left <= distance_up) & (distance_left <= distance_upper_left),
+        left,
+        np.where(distance_up <= distance_upper_left, up, upper_left))
+
+    filtered = np.empty((strip.shape[0], strip.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = PNG_FILTER_PAETH
+    filtered[:, 1:] = (raw - predictor) & 0xFF
+    return filtered
+
+
+def _chunk(chunk_type, data):
+    crc = zlib.crc32(data, zlib.crc32(chunk_type))
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
@@ -0,0 +1,84 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from .exporter_utils import convert_matrix
+
+
+MESH_DESCENDANT_TYPES = ("MESH", "CURVE")
+
+
+class SceneGraph():
+    """Parent and child relations of the objects of an export, built in one pass over the objects.
+
+    Object.children scans all objects of the file on every access before Blender 3.1,
+    so node writing only reads the relations from here. Child lists keep the order of
+    the objects in the blend data. Objects whose name or any ancestor's name starts
+    with "__" are not exported.
+    """
+
+    def __init__(self, objects):
+        self.objects = list(objects)
+        self.children = {obj.name_full: [] for obj in self.objects}
+        roots = []
+        for obj in self.objects:
+            if obj.parent:
+                self.children[obj.parent.name_full].append(obj)
+            else:
+                roots.append(obj)
+        # Objects without children first, like the objects were always written
+        self.roots = sorted(roots, key=lambda k: len(self.children[k.name_full]))
+        self.exported_children = {}
+        self.exported_objects = set()
+        self.local_matrices = {}
+        self.inverse_world_matrices = {}
+        self._has_mesh_descendant = {}
+        self._add_exported(obj for obj in self.roots if not obj.name.startswith("__"))
+
+    def _add_exported(self, objects):
+        pending = list(objects)
+        while pending:
+            obj = pending.pop()
+            self.exported_objects.add(obj.name_full)
+            exported_children = [child for child in self.children[obj.name_full] if not child.name.startswith("__")]
+            self.exported_children[obj.name_full] = exported_children
+            if obj.type != "MESH":
+                self.local_matrices[obj.name_full] = convert_matrix(obj.matrix_local)
+            if any(child.type == "MESH" for child in exported_children):
+                self.inverse_world_matrices[obj.name_full] = convert_matrix(obj.matrix_world.inverted())
+            pending.extend(exported_children)
+
+    def get_exported_roots(self):
+        return [obj for obj in self.roots if obj.name_full in self.exported_objects]
+
+    def is_exported(self, obj):
+        return obj.name_full in self.exported_objects
+
+    def has_mesh_descendant(self, obj):
+        """Whether any object below this one, exported or not, is a mesh or curve."""
+        if obj.name_full not in self._has_mesh_descendant:
+            # Post-order walk, so every flag is computed once from the flags of its children
+            pending = [(obj, False)]
+            while pending:
+                current, children_done = pending.pop()
+                if current.name_full in self._has_mesh_descendant:
+                    continue
+                children = self.children[current.name_full]
+                if children_done:
+                    self._has_mesh_descendant[current.name_full] = any(
+                        child.type in MESH_DESCENDANT_TYPES or self._has_mesh_descendant[child.name_full]
+                        for child in children)
+                else:
+                    pending.append((current, True))
+                    pending.extend((child, False) for child in children)
+        return self._has_mesh_descendant[obj.name_full]
@@ -0,0 +1,91 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import re
+
+
+WILDCARD = "*"
+PATTERN_SEPARATOR = "|"
+
+
+def convert_name_pattern(pattern):
+    """Converts a name pattern of settings.json like "1ROAD*" to a regex without anchors."""
+    return ".*".join(re.escape(part) for part in pattern.split(WILDCARD))
+
+
+class NameRules():
+    """Rules of a settings section, keyed by name patterns like "1ROAD*|KERB_*".
+
+    Patterns match whole names and ignore case. Exact names and patterns with a single
+    trailing wildcard are looked up in dictionaries, the other patterns are combined
+    into one regex that rejects non-matching names in one pass. Resolved rules are
+    remembered per name, as objects are looked up several times during an export.
+    """
+
+    def __init__(self):
+        self._rules = []
+        self._exact_names = {}
+        self._prefixes = {}
+        self._prefix_lengths = []
+        self._patterns = []
+        self._combined_pattern = None
+        self._resolved = {}
+
+    def __len__(self):
+        return len(self._rules)
+
+    def add(self, key, rule):
+        """Adds a rule for the names matching the key. Rules added later win over earlier ones."""
+        rule_index = len(self._rules)
+        self._rules.append(rule)
+        for pattern in key.split(PATTERN_SEPARATOR):
+            folded_pattern = pattern.lower()
+            wildcard_position = folded_pattern.find(WILDCARD)
+            if wildcard_position < 0:
+                self._exact_names.setdefault(folded_pattern, []).append(rule_index)
+            elif wildcard_position == len(folded_pattern) - 1:
+                prefix = folded_pattern[:-1]
+                if len(prefix) not in self._prefix_lengths:
+                    self._prefix_lengths.append(len(prefix))
+                    self._prefix_lengths.sort()
+                self._prefixes.setdefault(prefix, []).append(rule_index)
+            else:
+                self._patterns.append((rule_index, re.compile(f"^{convert_name_pattern(pattern)}$", re.IGNORECASE)))
+        self._combined_pattern = None
+        self._resolved = {}
+
+    def resolve(self, name):
+        """Returns the rules matching the name, in the order they were added."""
+        if name in self._resolved:
+            return self._resolved[name]
+        folded_name = name.lower()
+        rule_indices = set(self._exact_names.get(folded_name, ()))
+        for prefix_length in self._prefix_lengths:
+            if prefix_length > len(folded_name):
+                break
+            rule_indices.update(self._prefixes.get(folded_name[:prefix_length], ()))
+        if self._patterns and self._get_combined_pattern().match(name):
+            rule_indices.update(rule_index for rule_index, pattern in self._patterns if pattern.match(name))
+        rules = tuple(self._rules[rule_index] for rule_index in sorted(rule_indices))
+        self._resolved[name] = rules
+        return rules
+
+    def matches(self, name):
+        return bool(self.resolve(name))
+
+    def _get_combined_pattern(self):
+        if self._combined_pattern is None:
+            alternatives = "|".join(pattern.pattern[1:-1] for _rule_index, pattern in self._patterns)
+            self._combined_pattern = re.compile(f"^(?:{alternatives})$", re.IGNORECASE)
+        return self._combined_pattern
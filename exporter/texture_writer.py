@@ -14,68 +14,268 @@
 # Copyright (C) 2014  Thomas Hagnhofer
 
 
-from .kn5_writer import KN5Writer
-from .exporter_utils import get_all_texture_nodes
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import bpy
+import numpy as np
+from .export_cache import HASH_PREFIX_SIZE, hash_file, hash_file_prefix, hash_key
+from .export_scope import ExportScope
+from .export_statistics import ExportStatistics
+from .png_encoder import encode_png
+from ..kn5.writer import KN5Writer
 
 
 DDS_HEADER_BYTES = b"DDS"
+PNG_HEADER_BYTES = b"\x89PNG"
+
+STREAMED_FILE_FORMATS = ("PNG", "DDS", "")
+
+# Bump when the converted blobs change for the same source image, to invalidate cached textures
+TEXTURE_CACHE_VERSION = 2
+
+NON_COLOR_SPACES = ("Non-Color", "Raw")
+
+# Upper bound for the pixels read ahead of the texture being written
+MAX_PENDING_PIXEL_BYTES = 1024 * 1024 * 1024
 
 
 class TextureWriter(KN5Writer):
-    def __init__(self, file, context, warnings):
+    def __init__(self, file, context, warnings, texture_cache=None, png_compression=6, encoder_threads=0,
+                 statistics=None, scope=None):
         super().__init__(file)
 
         self.available_textures = {}
         self.texture_positions = {}
+        self.texture_aliases = {}
+        self.deduplicated_bytes = 0
         self.warnings = warnings
         self.context = context
+        self.texture_cache = texture_cache
+        self.png_compression = png_compression
+        self.encoder_threads = encoder_threads or os.cpu_count() or 1
+        self.statistics = statistics or ExportStatistics()
+        self.scope = scope or ExportScope(context)
         self._fill_available_image_textures()
 
     def write(self):
         self.write_int(len(self.available_textures))
-        for texture_name, _position in sorted(self.texture_positions.items(), key=lambda k: k[1]):
-            self._write_texture(self.available_textures[texture_name])
+        textures = [
+            self.available_textures[texture_name]
+            for texture_name, _position in sorted(self.texture_positions.items(), key=lambda k: k[1])
+        ]
+        blob_sizes = {}
+        # Images are read on this thread, which is the only one allowed to use bpy, while PNG
+        # encoding runs on worker threads. Blobs are still written in texture position order.
+        with ThreadPoolExecutor(max_workers=self.encoder_threads) as executor:
+            upcoming = deque(textures)
+            pending = deque()
+            pending_pixel_bytes = 0
+            while upcoming or pending:
+                while upcoming and (not pending or (
+                        len(pending) <= self.encoder_threads
+                        and pending_pixel_bytes < MAX_PENDING_PIXEL_BYTES)):
+                    texture = upcoming.popleft()
+                    blob = self._prepare_texture_blob(texture, executor)
+                    pending_pixel_bytes += blob.pixel_bytes
+                    pending.append((texture, blob))
+                texture, blob = pending.popleft()
+                pending_pixel_bytes -= blob.pixel_bytes
+                blob_sizes[texture.image.name] = self._write_texture(texture, blob)
+                self.statistics.add("textures")
+                self.statistics.add("texture_bytes", blob_sizes[texture.image.name])
+        self.deduplicated_bytes = sum(blob_sizes[canonical_name] for canonical_name in self.texture_aliases.values())
 
-    def _write_texture(self, texture):
+    def _write_texture(self, texture, blob):
         is_active = 1
         self.write_int(is_active)
         self.write_string(texture.image.name)
-        image_data = self._get_image_data_from_texture(texture)
+        if blob.path:
+            return self.write_file_blob(blob.path)
+        image_data = blob.get_data()
+        if blob.cache_key:
+            self.texture_cache.store(blob.cache_key, image_data)
         self.write_blob(image_data)
+        return len(image_data)
 
     def _fill_available_image_textures(self):
         self.available_textures = {}
         self.texture_positions = {}
         position = 0
 
-        all_texture_nodes = get_all_texture_nodes(self.context)
+        all_texture_nodes = self.scope.material_index.get_all_texture_nodes(self.scope.objects)
         for texture_node in all_texture_nodes:
             if not texture_node.name.startswith("__"):
                 if not texture_node.image:
                     self.warnings.append(f"Ignoring texture node without image '{texture_node.name}'")
-                elif not texture_node.image.pixels:
+                elif not self._has_image_data(texture_node.image):
                     self.warnings.append(f"Ignoring texture node without image data '{texture_node.name}'")
                 else:
                     self.available_textures[texture_node.image.name] = texture_node
                     self.texture_positions[texture_node.image.name] = position
                     position += 1
+        self._deduplicate_textures()
 
-    def _get_image_data_from_texture(self, texture):
-        image_copy = texture.image.copy()
+    def _deduplicate_textures(self):
+        """Keeps one texture per distinct image content and maps the other image names to it."""
+        self.texture_aliases = {}
+        candidates_by_size = {}
+        for texture_name, _position in sorted(self.texture_positions.items(), key=lambda k: k[1]):
+            image = self.available_textures[texture_name].image
+            source_size = self._get_image_source_size(image)
+            if source_size is not None:
+                candidates_by_size.setdefault(source_size, []).append(image)
+
+        candidates_by_prefix = {}
+        for images in candidates_by_size.values():
+            # Only images sharing their size with another one need to be hashed
+            if len(images) < 2:
+                continue
+            for image in images:
+                prefix_key = (
+                    self._get_image_prefix_hash(image),
+                    image.file_format,
+                    image.colorspace_settings.name,
+                    image.alpha_mode,
+                )
+                candidates_by_prefix.setdefault(prefix_key, []).append(image)
+
+        canonical_names = {}
+        for prefix_key, images in candidates_by_prefix.items():
+            # Most different images of the same size already differ in their first bytes
+            if len(images) < 2:
+                continue
+            for image in images:
+                content_key = (self._get_image_content_hash(image), *prefix_key[1:])
+                if content_key in canonical_names:
+                    self.texture_aliases[image.name] = canonical_names[content_key]
+                else:
+                    canonical_names[content_key] = image.name
+
+        if self.texture_aliases:
+            texture_names = sorted(self.texture_positions, key=lambda k: self.texture_positions[k])
+            self.texture_positions = {}
+            for texture_name in texture_names:
+                if texture_name in self.texture_aliases:
+                    del self.available_textures[texture_name]
+                else:
+                    self.texture_positions[texture_name] = len(self.texture_positions)
+
+    @staticmethod
+    def _get_image_source_size(image):
+        if image.is_dirty:
+            return None
+        if image.packed_file:
+            return image.packed_file.size
+        if image.source == "FILE":
+            image_path = bpy.path.abspath(image.filepath, library=image.library)
+            if os.path.isfile(image_path):
+                return os.path.getsize(image_path)
+        return None
+
+    @staticmethod
+    def _get_image_prefix_hash(image):
+        if image.packed_file:
+            return hashlib.blake2b(image.packed_file.data[:HASH_PREFIX_SIZE], digest_size=16).hexdigest()
+        return hash_file_prefix(bpy.path.abspath(image.filepath, library=image.library))
+
+    def _get_image_content_hash(self, image):
+        if image.packed_file:
+            return hashlib.blake2b(image.packed_file.data, digest_size=16).hexdigest()
+        image_path = bpy.path.abspath(image.filepath, library=image.library)
+        if self.texture_cache:
+            return self.texture_cache.get_file_content_hash(image_path)
+        return hash_file(image_path)
+
+    def _has_image_data(self, image):
+        # Checking the pixels loads the whole image, files that are copied as they are don't need it
+        if self._get_streamable_image_path(image):
+            return True
+        return bool(image.pixels)
+
+    @staticmethod
+    def _get_streamable_image_path(image):
+        """Returns the path of an unmodified PNG or DDS file that can be copied into the KN5 as it is."""
+        if image.packed_file or image.source != "FILE" or image.is_dirty:
+            return None
+        if image.file_format not in STREAMED_FILE_FORMATS:
+            return None
+        image_path = bpy.path.abspath(image.filepath, library=image.library)
+        if not os.path.isfile(image_path):
+            return None
+        with open(image_path, "rb") as image_file:
+            image_header_magic_bytes = image_file.read(len(PNG_HEADER_BYTES))
+        if image_header_magic_bytes.startswith(DDS_HEADER_BYTES):
+            return image_path
+        if image.file_format != "" and image_header_magic_bytes == PNG_HEADER_BYTES:
+            return image_path
+        return None
+
+    def _prepare_texture_blob(self, texture, executor):
+        image = texture.image
+        image_path = self._get_streamable_image_path(image)
+        if image_path:
+            self.statistics.add("textures_copied")
+            return TextureBlob(path=image_path)
+        cache_key = None
+        if self.texture_cache and image.file_format not in STREAMED_FILE_FORMATS:
+            cache_key = self._get_texture_cache_key(image)
+            if cache_key:
+                image_data = self.texture_cache.load(cache_key)
+                if image_data is not None:
+                    self.statistics.add("textures_cached")
+                    return TextureBlob(data=image_data)
+        if image.file_format in STREAMED_FILE_FORMATS:
+            image_data = self._get_packed_image_data(image)
+            if image_data is not None:
+                self.statistics.add("textures_packed")
+                return TextureBlob(data=image_data)
+        width, height = image.size
+        pixels = np.empty(width * height * image.channels, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+        linear_to_srgb = image.is_float and image.colorspace_settings.name not in NON_COLOR_SPACES
+        self.statistics.add("textures_converted")
+        future = executor.submit(
+            encode_png, pixels, width, height, image.channels, self.png_compression, linear_to_srgb)
+        return TextureBlob(future=future, cache_key=cache_key, pixel_bytes=pixels.nbytes)
+
+    def _get_packed_image_data(self, image):
+        image_copy = image.copy()
         try:
-            if image_copy.file_format in ("PNG", "DDS", ""):
-                if not image_copy.packed_file:
-                    image_copy.pack()
-                image_data = image_copy.packed_file.data
-                image_header_magic_bytes = image_data[:3]
-                if image_copy.file_format != "" or image_header_magic_bytes == DDS_HEADER_BYTES:
-                    return image_data
-            return self._convert_image_to_png(image_copy)
+            if not image_copy.packed_file:
+                image_copy.pack()
+            image_data = image_copy.packed_file.data
+            image_header_magic_bytes = image_data[:3]
+            if image_copy.file_format != "" or image_header_magic_bytes == DDS_HEADER_BYTES:
+                return image_data
+            return None
         finally:
             self.context.blend_data.images.remove(image_copy)
 
-    def _convert_image_to_png(self, image):
-        if not image.packed_file:
-            image.unpack(method="WRITE_LOCAL")
-        image.pack()
-        return image.packed_file.data
+    def _get_texture_cache_key(self, image):
+        if self._get_image_source_size(image) is None:
+            return None
+        return hash_key(
+            TEXTURE_CACHE_VERSION,
+            bpy.app.version,
+            self._get_image_content_hash(image),
+            image.file_format,
+            image.colorspace_settings.name,
+            image.alpha_mode,
+            self.png_compression,
+        )
+
+
+class TextureBlob:
+    def __init__(self, path=None, data=None, future=None, cache_key=None, pixel_bytes=0):
+        self.path = path
+        self.data = data
+        self.future = future
+        self.cache_key = cache_key
+        self.pixel_bytes = pixel_bytes
+
+    def get_data(self):
+        if self.future:
+            return self.future.result()
+        return self.data
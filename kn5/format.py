@@ -0,0 +1,50 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Binary layout of KN5 files, shared by the writer, the reader and the exporter."""
+
+
+import struct
+import numpy as np
+
+
+KN5_HEADER_BYTES = b"sc6969"
+
+NODE_CLASS = {
+    "Node" : 1,
+    "Mesh" : 2,
+    "SkinnedMesh" : 3,
+}
+
+ENCODING = 'utf-8'
+
+UINT = struct.Struct("I")
+INT = struct.Struct("i")
+USHORT = struct.Struct("H")
+BYTE = struct.Struct("B")
+BOOL = struct.Struct("?")
+FLOAT = struct.Struct("f")
+VECTOR2 = struct.Struct("2f")
+VECTOR3 = struct.Struct("3f")
+VECTOR4 = struct.Struct("4f")
+MATRIX = struct.Struct("16f")
+
+# Matches the per-vertex layout written to the file: position, normal, uv, tangent
+VERTEX_DTYPE = np.dtype([
+    ("position", np.float32, 3),
+    ("normal", np.float32, 3),
+    ("uv", np.float32, 2),
+    ("tangent", np.float32, 3),
+])
+
+INDEX_DTYPE = np.uint16
@@ -0,0 +1,332 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Lazy reader for the KN5 layout written by KN5FileWriter.
+
+The file is memory-mapped and only the section headers are parsed up front.
+Texture blobs are exposed as zero-copy memoryview slices and mesh vertex and
+index buffers as read-only NumPy views into the mapping, so nothing is copied
+until it is used:
+
+    with KN5File("track.kn5") as kn5:
+        for node in kn5.iter_nodes():
+            if node.is_mesh:
+                print(node.name, len(node.vertices), node.vertices["position"].mean(axis=0))
+
+Views returned by the reader keep the mapping alive, it is only unmapped
+once close() was called and the last of them is gone.
+"""
+
+
+import mmap
+import numpy as np
+from .format import (
+    BOOL,
+    BYTE,
+    ENCODING,
+    FLOAT,
+    INDEX_DTYPE,
+    INT,
+    KN5_HEADER_BYTES,
+    MATRIX,
+    NODE_CLASS,
+    UINT,
+    VECTOR2,
+    VECTOR3,
+    VECTOR4,
+    VERTEX_DTYPE,
+)
+
+
+DDS_HEADER_BYTES = b"DDS "
+PNG_HEADER_BYTES = b"\x89PNG"
+
+
+class KN5Cursor():
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.offset = offset
+
+    def read(self, packer):
+        values = packer.unpack_from(self.buffer, self.offset)
+        self.offset += packer.size
+        return values
+
+    def read_uint(self):
+        return self.read(UINT)[0]
+
+    def read_int(self):
+        return self.read(INT)[0]
+
+    def read_byte(self):
+        return self.read(BYTE)[0]
+
+    def read_bool(self):
+        return self.read(BOOL)[0]
+
+    def read_float(self):
+        return self.read(FLOAT)[0]
+
+    def read_vector2(self):
+        return self.read(VECTOR2)
+
+    def read_vector3(self):
+        return self.read(VECTOR3)
+
+    def read_vector4(self):
+        return self.read(VECTOR4)
+
+    def read_matrix(self):
+        values = self.read(MATRIX)
+        # Undo the transposition done by KN5Writer.write_matrix
+        return tuple(tuple(values[row * 4 + col] for row in range(4)) for col in range(4))
+
+    def read_string(self):
+        size = self.read_uint()
+        string = bytes(self.buffer[self.offset:self.offset + size]).decode(ENCODING)
+        self.offset += size
+        return string
+
+    def skip_blob(self):
+        size = self.read_uint()
+        offset = self.offset
+        self.offset += size
+        if self.offset > len(self.buffer):
+            raise Exception(f"Blob at offset {offset} runs past the end of the file")
+        return offset, size
+
+    def read_array(self, dtype, count):
+        array = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.offset)
+        self.offset += array.nbytes
+        return array
+
+
+class KN5Texture():
+    def __init__(self, kn5_file, name, active, offset, size):
+        self._kn5_file = kn5_file
+        self.name = name
+        self.active = active
+        self.offset = offset
+        self.size = size
+
+    @property
+    def data(self):
+        """Zero-copy view of the texture blob."""
+        return self._kn5_file.view[self.offset:self.offset + self.size]
+
+    @property
+    def image_format(self):
+        magic = bytes(self._kn5_file.view[self.offset:self.offset + 4])
+        if magic == DDS_HEADER_BYTES:
+            return "DDS"
+        if magic == PNG_HEADER_BYTES:
+            return "PNG"
+        return ""
+
+    def to_bytes(self):
+        return bytes(self.data)
+
+
+class KN5ShaderProperty():
+    def __init__(self, name, value_a, value_b, value_c, value_d):
+        self.name = name
+        self.valueA = value_a
+        self.valueB = value_b
+        self.valueC = value_c
+        self.valueD = value_d
+
+
+class KN5Material():
+    def __init__(self, name, shader_name, alpha_blend_mode, alpha_tested, depth_mode):
+        self.name = name
+        self.shaderName = shader_name
+        self.alphaBlendMode = alpha_blend_mode
+        self.alphaTested = alpha_tested
+        self.depthMode = depth_mode
+        self.shaderProperties = {}
+        self.texture_mapping = {}
+
+
+class KN5Node():
+    def __init__(self, node_class, name, child_count, active):
+        self.node_class = node_class
+        self.name = name
+        self.child_count = child_count
+        self.active = active
+        self.children = []
+        self.transform = None
+
+    @property
+    def is_mesh(self):
+        return self.node_class == NODE_CLASS["Mesh"]
+
+
+class KN5MeshNode(KN5Node):
+    def __init__(self, node_class, name, child_count, active):
+        super().__init__(node_class, name, child_count, active)
+        self.castShadows = True
+        self.visible = True
+        self.transparent = False
+        self.vertices = np.empty(0, dtype=VERTEX_DTYPE)
+        self.indices = np.empty(0, dtype=INDEX_DTYPE)
+        self.material_id = 0
+        self.layer = 0
+        self.lodIn = 0.0
+        self.lodOut = 0.0
+        self.bounding_sphere_center = (0.0, 0.0, 0.0)
+        self.bounding_sphere_radius = 0.0
+        self.renderable = True
+
+
+class KN5File():
+    """Memory-mapped KN5 file, see the module docstring for usage."""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self.textures = []
+        self.materials = []
+        self.root = None
+        with open(path, "rb") as file:
+            try:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as error:
+                raise Exception(f"'{path}' is not a KN5 file") from error
+        self.view = memoryview(self._mmap)
+        self._read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._mmap is None:
+            return
+        self.root = None
+        self.textures = []
+        self.materials = []
+        try:
+            self.view.release()
+            self._mmap.close()
+        except BufferError:
+            # Views handed out by the reader are still alive, the mapping is freed with the last of them
+            pass
+        self._mmap = None
+
+    def iter_nodes(self):
+        """Yields all nodes depth-first in file order."""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    @property
+    def meshes(self):
+        return [node for node in self.iter_nodes() if node.is_mesh]
+
+    def _read(self):
+        cursor = KN5Cursor(self.view)
+        self._read_header(cursor)
+        self._read_textures(cursor)
+        self._read_materials(cursor)
+        self._read_nodes(cursor)
+
+    def _read_header(self, cursor):
+        if bytes(self.view[:len(KN5_HEADER_BYTES)]) != KN5_HEADER_BYTES:
+            raise Exception(f"'{self.path}' is not a KN5 file")
+        cursor.offset = len(KN5_HEADER_BYTES)
+        self.version = cursor.read_uint()
+        if self.version > 5:
+            # Newer files carry an extra value after the version
+            cursor.read_uint()
+
+    def _read_textures(self, cursor):
+        texture_count = cursor.read_int()
+        for _ in range(texture_count):
+            active = cursor.read_int()
+            name = cursor.read_string()
+            offset, size = cursor.skip_blob()
+            self.textures.append(KN5Texture(self, name, active, offset, size))
+
+    def _read_materials(self, cursor):
+        material_count = cursor.read_int()
+        for _ in range(material_count):
+            material = KN5Material(
+                cursor.read_string(),
+                cursor.read_string(),
+                cursor.read_byte(),
+                cursor.read_bool(),
+                cursor.read_int(),
+            )
+            property_count = cursor.read_uint()
+            for _ in range(property_count):
+                shader_property = KN5ShaderProperty(
+                    cursor.read_string(),
+                    cursor.read_float(),
+                    cursor.read_vector2(),
+                    cursor.read_vector3(),
+                    cursor.read_vector4(),
+                )
+                material.shaderProperties[shader_property.name] = shader_property
+            mapping_count = cursor.read_uint()
+            for _ in range(mapping_count):
+                mapping_name = cursor.read_string()
+                _texture_slot = cursor.read_uint()
+                material.texture_mapping[mapping_name] = cursor.read_string()
+            self.materials.append(material)
+
+    def _read_nodes(self, cursor):
+        self.root = read_node(cursor)
+        pending = [(self.root, self.root.child_count)]
+        while pending:
+            parent, remaining = pending.pop()
+            if not remaining:
+                continue
+            pending.append((parent, remaining - 1))
+            node = read_node(cursor)
+            parent.children.append(node)
+            pending.append((node, node.child_count))
+
+
+def read_node(cursor):
+    """Reads one node record without its children, which follow it in the stream."""
+    node_class = cursor.read_uint()
+    if node_class == NODE_CLASS["Node"]:
+        node = KN5Node(node_class, cursor.read_string(), cursor.read_uint(), cursor.read_bool())
+        node.transform = cursor.read_matrix()
+    elif node_class == NODE_CLASS["Mesh"]:
+        node = KN5MeshNode(node_class, cursor.read_string(), cursor.read_uint(), cursor.read_bool())
+        _read_mesh(cursor, node)
+    else:
+        raise Exception(f"Unsupported node class {node_class} at offset {cursor.offset - UINT.size}")
+    return node
+
+
+def _read_mesh(cursor, node):
+    node.castShadows = cursor.read_bool()
+    node.visible = cursor.read_bool()
+    node.transparent = cursor.read_bool()
+    vertex_count = cursor.read_uint()
+    node.vertices = cursor.read_array(VERTEX_DTYPE, vertex_count)
+    index_count = cursor.read_uint()
+    node.indices = cursor.read_array(INDEX_DTYPE, index_count)
+    node.material_id = cursor.read_uint()
+    node.layer = cursor.read_uint()
+    node.lodIn = cursor.read_float()
+    node.lodOut = cursor.read_float()
+    node.bounding_sphere_center = cursor.read_vector3()
+    node.bounding_sphere_radius = cursor.read_float()
+    node.renderable = cursor.read_bool()
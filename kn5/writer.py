@@ -0,0 +1,148 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import os
+from .format import BOOL, BYTE, ENCODING, FLOAT, INT, MATRIX, UINT, USHORT, VECTOR2, VECTOR3, VECTOR4
+
+
+FLUSH_SIZE = 4 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class KN5BufferedStream():
+    """In-memory buffer in front of the output file, written out in large chunks.
+
+    Primitive values are appended to `buffer` directly without a size check, the
+    buffer is flushed from `write()`, which every string and blob goes through.
+    """
+
+    def __init__(self, file, flush_size=FLUSH_SIZE):
+        self.file = file
+        self.flush_size = flush_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        if len(data) >= self.flush_size:
+            self.flush()
+            self.file.write(data)
+            return
+        self.buffer += data
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            del self.buffer[:]
+
+    def write_file(self, path, size):
+        """Copies the first `size` bytes of a file to the output without reading it into memory."""
+        self.flush()
+        with open(path, "rb", buffering=0) as source:
+            copied = self._copy_file_descriptor(source, size)
+            source.seek(copied)
+            while copied < size:
+                chunk = source.read(min(COPY_CHUNK_SIZE, size - copied))
+                if not chunk:
+                    raise Exception(f"File '{path}' changed while it was being written")
+                self.file.write(chunk)
+                copied += len(chunk)
+
+    def _copy_file_descriptor(self, source, size):
+        try:
+            output_fd = self.file.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return 0
+        self.file.flush()
+        copied = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while copied < size:
+                    count = os.copy_file_range(source.fileno(), output_fd, size - copied, copied)
+                    if count == 0:
+                        return copied
+                    copied += count
+            except OSError:
+                # Not supported by this kernel or file system, try sendfile instead
+                pass
+        if hasattr(os, "sendfile"):
+            try:
+                while copied < size:
+                    count = os.sendfile(output_fd, source.fileno(), copied, size - copied)
+                    if count == 0:
+                        return copied
+                    copied += count
+            except OSError:
+                # Platforms like macOS only support sendfile to sockets
+                pass
+        return copied
+
+
+class KN5Writer():
+    def __init__(self, file):
+        if not isinstance(file, KN5BufferedStream):
+            file = KN5BufferedStream(file)
+        self.file = file
+
+    def flush(self):
+        self.file.flush()
+
+    def write_string(self, string):
+        string_bytes = string.encode(ENCODING)
+        self.write_uint(len(string_bytes))
+        self.file.write(string_bytes)
+
+    def write_blob(self, blob):
+        self.write_uint(len(blob))
+        self.file.write(blob)
+
+    def write_file_blob(self, path):
+        size = os.path.getsize(path)
+        self.write_uint(size)
+        self.file.write_file(path, size)
+        return size
+
+    def write_array(self, array):
+        self.file.write(memoryview(array).cast("B"))
+
+    def write_uint(self, int_val):
+        self.file.buffer += UINT.pack(int_val)
+
+    def write_int(self, int_val):
+        self.file.buffer += INT.pack(int_val)
+
+    def write_ushort(self, short):
+        self.file.buffer += USHORT.pack(short)
+
+    def write_byte(self, byte):
+        self.file.buffer += BYTE.pack(byte)
+
+    def write_bool(self, bool_val):
+        self.file.buffer += BOOL.pack(bool_val)
+
+    def write_float(self, f):
+        self.file.buffer += FLOAT.pack(f)
+
+    def write_vector2(self, vector2):
+        self.file.buffer += VECTOR2.pack(*vector2)
+
+    def write_vector3(self, vector3):
+        self.file.buffer += VECTOR3.pack(*vector3)
+
+    def write_vector4(self, vector4):
+        self.file.buffer += VECTOR4.pack(*vector4)
+
+    def write_matrix(self, matrix):
+        self.file.buffer += MATRIX.pack(*[matrix[col][row] for row in range(4) for col in range(4)])
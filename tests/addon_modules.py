@@ -0,0 +1,42 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Loads modules of the add-on that don't need Blender."""
+
+
+import importlib
+import os
+import sys
+import types
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADDON_PACKAGE = "kn5_addon"
+
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def load_exporter_module(name):
+    """Imports a numpy-only module of the exporter package.
+
+    The add-on and exporter packages import bpy in their __init__ files, so they are
+    registered as empty packages and only the requested module and its imports run.
+    """
+    for package_name, package_dir in ((ADDON_PACKAGE, ROOT_DIR), (f"{ADDON_PACKAGE}.exporter", "exporter")):
+        if package_name not in sys.modules:
+            package = types.ModuleType(package_name)
+            package.__path__ = [os.path.join(ROOT_DIR, package_dir)]
+            sys.modules[package_name] = package
+    return importlib.import_module(f"{ADDON_PACKAGE}.exporter.{name}")
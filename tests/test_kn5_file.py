@@ -0,0 +1,165 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Round trip of the KN5 writer and the memory-mapped reader, which run without Blender:
+
+    python -m unittest discover tests
+"""
+
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import addon_modules # pylint: disable=unused-import
+from kn5.format import INDEX_DTYPE, KN5_HEADER_BYTES, NODE_CLASS, VERTEX_DTYPE
+from kn5.reader import KN5Cursor, KN5File, read_node
+from kn5.writer import KN5Writer
+
+
+PNG_BLOB = b"\x89PNG\r\n\x1a\n" + bytes(range(32))
+DDS_BLOB = b"DDS " + bytes(range(16))
+
+ROOT_TRANSFORM = [[float(row * 4 + col) for col in range(4)] for row in range(4)]
+
+
+def make_vertices():
+    vertices = np.zeros(4, dtype=VERTEX_DTYPE)
+    vertices["position"] = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (1.0, 0.0, 1.0), (0.0, 0.0, 1.0)]
+    vertices["normal"] = (0.0, 1.0, 0.0)
+    vertices["uv"] = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]
+    vertices["tangent"] = (1.0, 0.0, 0.0)
+    return vertices
+
+
+def write_mesh(writer, name, vertices, indices):
+    """Writes a mesh node like NodeWriter._write_mesh."""
+    writer.write_uint(NODE_CLASS["Mesh"])
+    writer.write_string(name)
+    writer.write_uint(0)
+    writer.write_bool(True)
+    writer.write_bool(False)
+    writer.write_bool(True)
+    writer.write_bool(True)
+    writer.write_uint(len(vertices))
+    writer.write_array(vertices)
+    writer.write_uint(len(indices))
+    writer.write_array(indices)
+    writer.write_uint(1)
+    writer.write_uint(2)
+    writer.write_float(10.0)
+    writer.write_float(500.0)
+    writer.write_vector3((0.5, 0.0, 0.5))
+    writer.write_float(0.75)
+    writer.write_bool(True)
+
+
+def write_kn5(file, vertices, indices):
+    """Writes the sections in the order of KN5FileWriter: header, textures, materials and nodes."""
+    writer = KN5Writer(file)
+    writer.file.write(KN5_HEADER_BYTES)
+    writer.write_uint(5)
+
+    writer.write_int(2)
+    for name, blob in (("grass.png", PNG_BLOB), ("road.dds", DDS_BLOB)):
+        writer.write_int(1)
+        writer.write_string(name)
+        writer.write_blob(blob)
+
+    writer.write_int(1)
+    writer.write_string("asphalt")
+    writer.write_string("ksPerPixel")
+    writer.write_byte(0)
+    writer.write_bool(True)
+    writer.write_int(0)
+    writer.write_uint(1)
+    writer.write_string("ksDiffuse")
+    writer.write_float(0.4)
+    writer.write_vector2((1.0, 2.0))
+    writer.write_vector3((1.0, 2.0, 3.0))
+    writer.write_vector4((1.0, 2.0, 3.0, 4.0))
+    writer.write_uint(1)
+    writer.write_string("txDiffuse")
+    writer.write_uint(0)
+    writer.write_string("road.dds")
+
+    writer.write_uint(NODE_CLASS["Node"])
+    writer.write_string("BlenderFile")
+    writer.write_uint(2)
+    writer.write_bool(True)
+    writer.write_matrix(ROOT_TRANSFORM)
+    write_mesh(writer, "1ROAD_0", vertices, indices)
+    writer.write_uint(NODE_CLASS["Node"])
+    writer.write_string("AC_START_0")
+    writer.write_uint(0)
+    writer.write_bool(True)
+    writer.write_matrix(ROOT_TRANSFORM)
+    writer.flush()
+
+
+class KN5FileTest(unittest.TestCase):
+    def setUp(self):
+        self.vertices = make_vertices()
+        self.indices = np.array([0, 1, 2, 0, 2, 3], dtype=INDEX_DTYPE)
+        file_descriptor, self.path = tempfile.mkstemp(suffix=".kn5")
+        with os.fdopen(file_descriptor, "wb") as file:
+            write_kn5(file, self.vertices, self.indices)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_textures(self):
+        with KN5File(self.path) as kn5:
+            self.assertEqual(kn5.version, 5)
+            self.assertEqual([texture.name for texture in kn5.textures], ["grass.png", "road.dds"])
+            self.assertEqual([texture.image_format for texture in kn5.textures], ["PNG", "DDS"])
+            self.assertEqual(kn5.textures[0].to_bytes(), PNG_BLOB)
+            self.assertEqual(bytes(kn5.textures[1].data), DDS_BLOB)
+
+    def test_materials(self):
+        with KN5File(self.path) as kn5:
+            material = kn5.materials[0]
+            self.assertEqual((material.name, material.shaderName), ("asphalt", "ksPerPixel"))
+            self.assertEqual((material.alphaBlendMode, material.alphaTested, material.depthMode), (0, True, 0))
+            shader_property = material.shaderProperties["ksDiffuse"]
+            self.assertAlmostEqual(shader_property.valueA, 0.4, places=6)
+            self.assertEqual(shader_property.valueD, (1.0, 2.0, 3.0, 4.0))
+            self.assertEqual(material.texture_mapping, {"txDiffuse": "road.dds"})
+
+    def test_nodes(self):
+        with KN5File(self.path) as kn5:
+            self.assertEqual([node.name for node in kn5.iter_nodes()], ["BlenderFile", "1ROAD_0", "AC_START_0"])
+            self.assertEqual(kn5.root.transform, tuple(tuple(row) for row in ROOT_TRANSFORM))
+            mesh = kn5.meshes[0]
+            np.testing.assert_array_equal(mesh.vertices, self.vertices)
+            np.testing.assert_array_equal(mesh.indices, self.indices)
+            self.assertEqual((mesh.castShadows, mesh.visible, mesh.transparent), (False, True, True))
+            self.assertEqual((mesh.material_id, mesh.layer, mesh.lodIn, mesh.lodOut), (1, 2, 10.0, 500.0))
+            self.assertEqual(mesh.bounding_sphere_center, (0.5, 0.0, 0.5))
+            self.assertEqual(mesh.bounding_sphere_radius, 0.75)
+
+    def test_read_node_from_buffer(self):
+        with tempfile.TemporaryFile() as file:
+            writer = KN5Writer(file)
+            write_mesh(writer, "cached", self.vertices, self.indices)
+            writer.flush()
+            file.seek(0)
+            record = file.read()
+        node = read_node(KN5Cursor(memoryview(record)))
+        self.assertTrue(node.is_mesh)
+        self.assertEqual(node.name, "cached")
+        np.testing.assert_array_equal(node.vertices["position"], self.vertices["position"])
+
+
+if __name__ == "__main__":
+    unittest.main()
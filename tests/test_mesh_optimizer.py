@@ -0,0 +1,96 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the vertex cache, overdraw and vertex fetch ordering, which only need numpy:
+
+    python -m unittest discover tests
+"""
+
+
+import unittest
+import numpy as np
+from addon_modules import load_exporter_module
+
+
+mesh_optimizer = load_exporter_module("mesh_optimizer")
+
+
+def make_grid_indices(width, height):
+    """Two triangles per quad of a width * height grid, row by row."""
+    indices = []
+    for row in range(height):
+        for col in range(width):
+            corner = row * (width + 1) + col
+            above = corner + width + 1
+            indices.extend((corner, above, corner + 1, corner + 1, above, above + 1))
+    return np.array(indices, dtype=np.int64)
+
+
+class OptimizeVertexCacheTest(unittest.TestCase):
+    def test_output_order(self):
+        indices = mesh_optimizer.optimize_vertex_cache(make_grid_indices(3, 2), 12)
+        self.assertEqual(indices.tolist(), [
+            0, 4, 1, 1, 4, 5, 4, 8, 5, 1, 5, 2, 2, 5, 6, 5, 8, 9,
+            5, 9, 6, 2, 6, 3, 3, 6, 7, 6, 9, 10, 6, 10, 7, 7, 10, 11,
+        ])
+
+    def test_keeps_triangles(self):
+        triangles = make_grid_indices(5, 4).reshape(-1, 3)
+        indices = mesh_optimizer.optimize_vertex_cache(triangles.ravel(), 30)
+        self.assertEqual(sorted(map(tuple, indices.reshape(-1, 3).tolist())), sorted(map(tuple, triangles.tolist())))
+
+    def test_reduces_cache_misses(self):
+        triangles = make_grid_indices(20, 20).reshape(-1, 3)
+        shuffled = triangles[np.random.default_rng(1).permutation(len(triangles))].ravel()
+        optimized = mesh_optimizer.optimize_vertex_cache(shuffled, 441)
+        self.assertEqual(mesh_optimizer.count_vertex_cache_misses(shuffled), 2314)
+        self.assertEqual(mesh_optimizer.count_vertex_cache_misses(optimized), 525)
+
+    def test_empty(self):
+        self.assertEqual(len(mesh_optimizer.optimize_vertex_cache(np.empty(0, dtype=np.int64), 0)), 0)
+
+
+class CountVertexCacheMissesTest(unittest.TestCase):
+    def test_fifo_cache(self):
+        indices = make_grid_indices(3, 2)
+        self.assertEqual(mesh_optimizer.count_vertex_cache_misses(indices), 12)
+        self.assertEqual(mesh_optimizer.count_vertex_cache_misses(indices, cache_size=3), 16)
+
+
+class OptimizeOverdrawTest(unittest.TestCase):
+    def setUp(self):
+        # Two upward facing quads, the upper one covers the lower one when seen from above
+        self.positions = np.array([
+            (0, 0, 0), (0, 0, 1), (1, 0, 1), (1, 0, 0),
+            (0, 5, 0), (0, 5, 1), (1, 5, 1), (1, 5, 0),
+        ], dtype=np.float32)
+        self.indices = [0, 1, 2, 0, 2, 3, 4, 5, 6, 4, 6, 7]
+
+    def test_outer_cluster_first(self):
+        indices = mesh_optimizer.optimize_overdraw(self.positions, self.indices, cluster_size=2)
+        self.assertEqual(indices.tolist(), [4, 5, 6, 4, 6, 7, 0, 1, 2, 0, 2, 3])
+
+    def test_single_cluster_unchanged(self):
+        indices = mesh_optimizer.optimize_overdraw(self.positions, self.indices)
+        self.assertEqual(indices.tolist(), self.indices)
+
+
+class OptimizeVertexFetchTest(unittest.TestCase):
+    def test_first_use_order(self):
+        vertices, indices = mesh_optimizer.optimize_vertex_fetch(np.arange(5), [3, 1, 3, 4, 1, 0])
+        self.assertEqual(vertices.tolist(), [3, 1, 4, 0])
+        self.assertEqual(indices.tolist(), [0, 1, 0, 2, 1, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
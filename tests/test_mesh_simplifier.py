@@ -0,0 +1,85 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the LOD mesh simplifier, which only needs numpy:
+
+    python -m unittest discover tests
+"""
+
+
+import unittest
+import numpy as np
+from addon_modules import load_exporter_module
+
+
+mesh_simplifier = load_exporter_module("mesh_simplifier")
+mesh_utils = load_exporter_module("mesh_utils")
+
+GRID_SIZE = 24
+SEAM_COLUMN = 11
+RIGHT_ISLAND_OFFSET = 10.0
+
+
+def make_seamed_grid():
+    """A wavy grid split into two UV islands along one column, which has a vertex for each island."""
+    vertices = []
+    vertex_indices = {}
+    for row in range(GRID_SIZE + 1):
+        for col in range(GRID_SIZE + 1):
+            islands = (0, 1) if col == SEAM_COLUMN else (int(col > SEAM_COLUMN),)
+            for island in islands:
+                vertex_indices[(row, col, island)] = len(vertices)
+                height = 0.3 * np.sin(col * 0.7) * np.cos(row * 0.5)
+                uv = (col / GRID_SIZE + island * RIGHT_ISLAND_OFFSET, row / GRID_SIZE)
+                vertices.append(((col, height, row), (0.0, 1.0, 0.0), uv, (1.0, 0.0, 0.0)))
+    triangles = []
+    for row in range(GRID_SIZE):
+        for col in range(GRID_SIZE):
+            island = int(col >= SEAM_COLUMN)
+            corners = [vertex_indices[(r, c, island)] for r, c in
+                       ((row, col), (row + 1, col), (row + 1, col + 1), (row, col + 1))]
+            triangles.extend((corners[0], corners[1], corners[2], corners[0], corners[2], corners[3]))
+    return np.array(vertices, dtype=mesh_utils.VERTEX_DTYPE), np.array(triangles, dtype=mesh_utils.INDEX_DTYPE)
+
+
+class SimplifyMeshTest(unittest.TestCase):
+    def test_triangle_count_within_ratio(self):
+        vertices, indices = make_seamed_grid()
+        new_vertices, new_indices = mesh_simplifier.simplify_mesh(vertices, indices, 0.25)
+        self.assertGreater(len(new_indices), 0)
+        self.assertLessEqual(len(new_indices) // 3, len(indices) // 3 * 0.25)
+        self.assertLess(new_indices.max(), len(new_vertices))
+
+    def test_uv_seam_is_kept(self):
+        vertices, indices = make_seamed_grid()
+        new_vertices, new_indices = mesh_simplifier.simplify_mesh(vertices, indices, 0.25)
+        triangle_islands = new_vertices["uv"][new_indices.reshape(-1, 3), 0] >= RIGHT_ISLAND_OFFSET
+        # No triangle stretches across both islands of the texture
+        self.assertTrue(np.all(triangle_islands.all(axis=1) | ~triangle_islands.any(axis=1)))
+        self.assertTrue(triangle_islands.any())
+        self.assertFalse(triangle_islands.all())
+
+    def test_seam_vertices_share_positions(self):
+        vertices, indices = make_seamed_grid()
+        new_vertices, new_indices = mesh_simplifier.simplify_mesh(vertices, indices, 0.25)
+        islands = new_vertices["uv"][:, 0] >= RIGHT_ISLAND_OFFSET
+        used = np.zeros(len(new_vertices), dtype=np.bool_)
+        used[new_indices] = True
+        left_positions = {tuple(position) for position in new_vertices["position"][used & ~islands]}
+        right_positions = {tuple(position) for position in new_vertices["position"][used & islands]}
+        # Both islands meet at the same positions, so the seam does not open a crack
+        self.assertTrue(left_positions & right_positions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of vertex welding, mesh splitting and bounding spheres, which only need numpy:
+
+    python -m unittest discover tests
+"""
+
+
+import unittest
+import numpy as np
+from addon_modules import load_exporter_module
+
+
+mesh_utils = load_exporter_module("mesh_utils")
+
+
+class WeldVerticesTest(unittest.TestCase):
+    def setUp(self):
+        self.positions = np.array([(0, 0, 0), (1, 0, 0), (0, 0, 0), (-0.0, 0, 0), (1.04, 0, 0)], dtype=np.float32)
+        self.uvs = np.array([(0, 0), (1, 0), (0, 0), (0, 0), (1, 0)], dtype=np.float32)
+
+    def test_exact(self):
+        first_indices, welded = mesh_utils.weld_vertices([self.positions, self.uvs])
+        # -0.0 and 0.0 are the same position
+        self.assertEqual(first_indices.tolist(), [0, 1, 4])
+        self.assertEqual(welded.tolist(), [0, 1, 0, 0, 2])
+
+    def test_tolerance(self):
+        first_indices, welded = mesh_utils.weld_vertices([self.positions, self.uvs], (0.1, 0.0))
+        self.assertEqual(first_indices.tolist(), [0, 1])
+        self.assertEqual(welded.tolist(), [0, 1, 0, 0, 1])
+
+    def test_other_attributes_split(self):
+        uvs = self.uvs.copy()
+        uvs[2] = (0.5, 0.5)
+        first_indices, welded = mesh_utils.weld_vertices([self.positions, uvs])
+        self.assertEqual(first_indices.tolist(), [0, 1, 2, 4])
+        self.assertEqual(welded.tolist(), [0, 1, 2, 0, 3])
+
+
+class SplitTrianglesSpatiallyTest(unittest.TestCase):
+    def test_groups_within_limit(self):
+        positions = np.random.default_rng(2).random((3000, 3))
+        indices = np.random.default_rng(3).integers(0, len(positions), 3000 * 3)
+        groups = mesh_utils.split_triangles_spatially(positions, indices, 300)
+        triangles = indices.reshape(-1, 3)
+        self.assertEqual(sorted(np.concatenate(groups).tolist()), list(range(len(triangles))))
+        for group in groups:
+            self.assertLessEqual(len(np.unique(triangles[group])), 300)
+
+    def test_fitting_mesh_is_one_group(self):
+        groups = mesh_utils.split_triangles_spatially(np.zeros((3, 3)), [0, 1, 2, 2, 1, 0], 3)
+        self.assertEqual([group.tolist() for group in groups], [[0, 1]])
+
+
+class BoundingSphereTest(unittest.TestCase):
+    def test_octahedron(self):
+        positions = np.array([(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)], dtype=np.float32)
+        center, radius = mesh_utils.calculate_bounding_sphere(positions)
+        self.assertEqual(center, [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(radius, 1.000001)
+
+    def test_cube_is_tighter_than_legacy(self):
+        positions = np.array([(x, y, z) for x in (0, 2) for y in (0, 2) for z in (0, 2)], dtype=np.float32)
+        center, radius = mesh_utils.calculate_bounding_sphere(positions)
+        self.assertEqual(center, [1.0, 1.0, 1.0])
+        self.assertAlmostEqual(radius, 3 ** 0.5, places=5)
+        self.assertEqual(mesh_utils.calculate_legacy_bounding_sphere(positions), ([1.0, 1.0, 1.0], 2.0))
+
+    def test_encloses_all_points(self):
+        positions = np.random.default_rng(4).normal(size=(2000, 3)).astype(np.float32) * (5.0, 1.0, 0.5)
+        center, radius = mesh_utils.calculate_bounding_sphere(positions)
+        distances = np.linalg.norm(positions.astype(np.float64) - center, axis=1)
+        self.assertLessEqual(distances.max(), radius)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,8 +12,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-KN5_HEADER_BYTES = b"sc6969"
-
 ASSETTO_CORSA_OBJECTS = (
     r"AC_START_\d+",
     r"AC_PIT_\d+",